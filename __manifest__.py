@@ -10,13 +10,18 @@
 'security/security.xml',
 'security/ir.model.access.csv',
 'data/service_type_data.xml',
+'data/ir_cron_data.xml',
+'data/invoice_layout_data.xml',
 'views/wizard_views.xml',
 'views/isp_service_views.xml',
 'views/isp_payment_history_views.xml',
 'views/isp_provider_views.xml',
+'views/isp_invoice_layout_views.xml',
 'views/isp_service_type_views.xml',
 'views/isp_bill_views.xml',
 'views/isp_payment_request_views.xml',
+'views/isp_import_job_views.xml',
+'views/isp_spend_report_views.xml',
 'reports/payment_request_report.xml',
 'views/menu.xml',
 ],
@@ -0,0 +1,52 @@
+import os
+
+from odoo import http
+from odoo.http import request, content_disposition
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Bytes sent per chunk when streaming an export
+EXPORT_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class ISPUsageController(http.Controller):
+
+    @http.route('/isp/usage', type='jsonrpc', auth='user', methods=['POST'])
+    def update_usage(self, usages, provider_id=None):
+        """ Bulk usage feed: {"usages": [{"line_number": "0551234567", "current_usage": 120}, ...]} """
+        return request.env['isp.service'].update_usage_bulk(usages, provider_id=provider_id)
+
+
+class ISPExportController(http.Controller):
+
+    @http.route('/isp/export/bill_lines', type='http', auth='user', methods=['GET'])
+    def export_bill_lines(self, bill_ids):
+        """ XLSX of the lines of the given bills: /isp/export/bill_lines?bill_ids=1,2 """
+        bill_ids = [int(bill_id) for bill_id in bill_ids.split(',') if bill_id.strip()]
+        path = request.env['isp.xlsx.export']._export_bill_lines(bill_ids)
+        return self._stream_file(path, 'bill_lines.xlsx')
+
+    @http.route('/isp/export/payment_history', type='http', auth='user', methods=['GET'])
+    def export_payment_history(self, date_from=None, date_to=None):
+        """ XLSX of the payment history the user can read, optionally for a period """
+        domain = []
+        if date_from:
+            domain.append(('date_from', '>=', date_from))
+        if date_to:
+            domain.append(('date_to', '<=', date_to))
+        path = request.env['isp.xlsx.export']._export_payment_history(domain)
+        return self._stream_file(path, 'payment_history.xlsx')
+
+    def _stream_file(self, path, filename):
+        """ Send the file in chunks and remove it once the response is closed,
+            it is never read in memory at once """
+        export_file = open(path, 'rb')
+        response = request.make_response(iter(lambda: export_file.read(EXPORT_STREAM_CHUNK_SIZE), b''), headers=[
+            ('Content-Type', XLSX_MIMETYPE),
+            ('Content-Length', os.path.getsize(path)),
+            ('Content-Disposition', content_disposition(filename)),
+        ])
+        # Closed by the WSGI server whether the download completed or not
+        response.call_on_close(export_file.close)
+        response.call_on_close(lambda: os.unlink(path))
+        return response
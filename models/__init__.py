@@ -1,6 +1,10 @@
 from . import isp_provider
+from . import isp_invoice_layout
 from . import isp_service_type
 from .import isp_payment_history
 from . import isp_service
 from . import isp_bill
 from . import isp_payment_request
+from . import isp_import_job
+from . import isp_spend_report
+from . import isp_xlsx_export
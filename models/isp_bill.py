@@ -1,4 +1,30 @@
+import logging
+from collections import defaultdict
+
+import numpy as np
+
 from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import SQL, date_utils, split_every
+
+_logger = logging.getLogger(__name__)
+
+# Number of isp.payment.history records created per create() call when posting payments
+PAYMENT_HISTORY_BATCH_SIZE = 5000
+
+# Number of isp.bill.line records inserted per create() call, by the recurring billing
+# and the invoice import (which commits after each batch)
+BILL_LINE_BATCH_SIZE = 1000
+
+# Number of bill lines scored per UPDATE statement by action_detect_anomalies
+ANOMALY_UPDATE_BATCH_SIZE = 10000
+
+# A bill line is an anomaly when its amount is more than ANOMALY_Z_SCORE standard
+# deviations away from the service's baseline (mean of its payments, else monthly_fee)
+ANOMALY_Z_SCORE = 3.0
+# The standard deviation is at least this share of the baseline, so a service that
+# always paid the same amount is not flagged for a small change
+ANOMALY_MIN_DEVIATION = 0.1
 
 class ISPBill(models.Model):
     _name = 'isp.bill'
@@ -24,13 +50,35 @@ class ISPBill(models.Model):
     
     total_amount = fields.Float(string="Total Amount", compute="_compute_total", store=True)
     currency_id = fields.Many2one('res.currency', string="Currency", default=lambda self: self.env.company.currency_id)
+    # SHA-256 of the imported file, used to detect the same invoice being imported twice
+    content_hash = fields.Char(string="Content Hash", index=True, readonly=True, copy=False)
+    recurring = fields.Boolean(string="Recurring", readonly=True, copy=False,
+                               help="Generated from the services' monthly fees")
 
 
-    summary_notes = fields.Text(string="Billing Summary", compute="_compute_bill_summary")
+    summary_notes = fields.Text(string="Billing Summary", compute="_compute_bill_summary", store=True)
+    anomaly_count = fields.Integer(string="Unusual Amounts", compute="_compute_anomaly_count")
+
+    @api.depends('line_ids.is_anomaly')
+    def _compute_anomaly_count(self):
+        counts = dict(self.env['isp.bill.line']._read_group(
+            [('bill_id', 'in', self.ids), ('is_anomaly', '=', True)], ['bill_id'], ['__count']))
+        for bill in self:
+            bill.anomaly_count = counts.get(bill._origin, 0)
 
     @api.depends('line_ids.amount')
     def _compute_total(self):
-        for bill in self:
+        # Saved bills: one grouped query, the lines are not loaded (an import adds
+        # them in batches, each batch would otherwise walk all the lines so far)
+        bills = self.filtered(lambda bill: isinstance(bill.id, int))
+        totals = {}
+        if bills:
+            totals = dict(self.env['isp.bill.line']._read_group(
+                [('bill_id', 'in', bills.ids)], ['bill_id'], ['amount:sum']))
+        for bill in bills:
+            bill.total_amount = totals.get(bill, 0.0)
+        # Bills being edited in a form are not in the database yet
+        for bill in self - bills:
             bill.total_amount = sum(line.amount for line in bill.line_ids)
 
     def action_confirm(self):
@@ -38,74 +86,289 @@ class ISPBill(models.Model):
 
     def action_post_payment(self):
         """ This method will be called when finance confirms payment. 
-            It will then create the entries in isp.payment.history """
-        for bill in self:
-            for line in bill.line_ids:
-                self.env['isp.payment.history'].create({
-                    'service_id': line.service_id.id,
-                    'amount': line.amount,
-                    'date_from': bill.date_from,
-                    'date_to': bill.date_to,
-                    'period_name': f"{bill.provider_id.name} - {bill.date_from.strftime('%b %Y')}"
-                })
-            bill.write({'state': 'paid'})
-
-    @api.depends('line_ids.amount', 'line_ids.service_type_id')
+            It will then create the entries in isp.payment.history for all the bills
+            at once: the history rows are created in batches with their department and
+            currency already resolved, and the bill states are flipped in one write. """
+        period_names = {
+            bill.id: f"{bill.provider_id.name} - {bill.date_from.strftime('%b %Y')}"
+            for bill in self
+        }
+        history_vals = (
+            {
+                'service_id': line.service_id.id,
+                'amount': line.amount,
+                'date_from': line.bill_id.date_from,
+                'date_to': line.bill_id.date_to,
+                'period_name': period_names[line.bill_id.id],
+                # given here so the history does not compute them one by one
+                'department_id': line.assign_department_id.id,
+                'currency_id': line.service_id.currency_id.id,
+            }
+            for line in self.line_ids
+        )
+        for vals_list in split_every(PAYMENT_HISTORY_BATCH_SIZE, history_vals, list):
+            self.env['isp.payment.history'].create(vals_list)
+        self.write({'state': 'paid'})
+
+    def action_create_payment_requests(self):
+        """ Create one payment request per selected draft bill, in a single create().
+            The request values come from the stored bill totals and summaries, and the
+            bills are switched to 'requested' by one grouped write in create(). """
+        bills = self.filtered(lambda bill: bill.state == 'draft')
+        if not bills:
+            raise UserError("Select at least one draft bill to request payment for.")
+        PaymentRequest = self.env['isp.payment.request']
+        requests = PaymentRequest.create([
+            dict(PaymentRequest._prepare_bill_values(bill), bill_id=bill.id)
+            for bill in bills
+        ])
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Payment Requests',
+            'res_model': 'isp.payment.request',
+            'view_mode': 'list,form',
+            'domain': [('id', 'in', requests.ids)],
+        }
+
+    def action_export_xlsx(self):
+        """ Download the lines of the bills as an XLSX file, see ISPExportController """
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/isp/export/bill_lines?bill_ids=%s' % ','.join(str(bill_id) for bill_id in self.ids),
+            'target': 'self',
+        }
+
+    def action_detect_anomalies(self):
+        """ Score every line of the bills against the history of its service.
+            The lines, the monthly fees and the whole payment history of the services
+            are loaded with two queries, the baselines and z-scores are computed with
+            NumPy over all lines at once, and the results are written back with
+            batched UPDATE statements. """
+        if not self.ids:
+            return
+        cr = self.env.cr
+        self.env['isp.bill.line'].flush_model(['bill_id', 'service_id', 'amount'])
+        self.env['isp.payment.history'].flush_model(['service_id', 'amount'])
+        self.env['isp.service'].flush_model(['monthly_fee'])
+
+        cr.execute(SQL("SELECT id, service_id, amount FROM isp_bill_line WHERE bill_id IN %s", tuple(self.ids)))
+        lines = np.array(cr.fetchall(), dtype=float).reshape(-1, 3)
+        if not len(lines):
+            return
+        line_ids, line_services, line_amounts = lines[:, 0].astype(int), lines[:, 1].astype(int), lines[:, 2]
+        services = np.unique(line_services)
+
+        # One row per payment, or a single row with a NULL amount for a service never paid
+        cr.execute(SQL("""
+            SELECT service.id, COALESCE(service.monthly_fee, 0), history.amount
+              FROM isp_service AS service
+         LEFT JOIN isp_payment_history AS history ON history.service_id = service.id
+             WHERE service.id = ANY(%s)
+        """, services.tolist()))
+        history = np.array(cr.fetchall(), dtype=float).reshape(-1, 3)
+        history_index = np.searchsorted(services, history[:, 0].astype(int))
+        paid = ~np.isnan(history[:, 2])
+        amounts = np.where(paid, history[:, 2], 0.0)
+
+        size = len(services)
+        count = np.bincount(history_index, weights=paid, minlength=size)
+        total = np.bincount(history_index, weights=amounts, minlength=size)
+        squares = np.bincount(history_index, weights=amounts ** 2, minlength=size)
+        fees = np.zeros(size)
+        fees[history_index] = history[:, 1]
+
+        has_history = count > 0
+        baseline = np.where(has_history, total / np.maximum(count, 1), fees)
+        variance = np.where(count > 1, squares / np.maximum(count, 1) - baseline ** 2, 0.0)
+        deviation = np.maximum(np.sqrt(np.clip(variance, 0, None)), ANOMALY_MIN_DEVIATION * np.abs(baseline))
+        # Without any payment nor fee there is nothing to compare with
+        known = has_history | (fees > 0)
+
+        line_index = np.searchsorted(services, line_services)
+        scores = np.where(
+            known[line_index],
+            (line_amounts - baseline[line_index]) / np.maximum(deviation[line_index], 1.0),
+            0.0,
+        )
+        flags = np.abs(scores) > ANOMALY_Z_SCORE
+
+        rows = zip(line_ids.tolist(), baseline[line_index].round(2).tolist(), scores.round(2).tolist(), flags.tolist())
+        for chunk in split_every(ANOMALY_UPDATE_BATCH_SIZE, rows):
+            cr.execute(SQL("""
+                UPDATE isp_bill_line AS line
+                   SET baseline_amount = score.baseline,
+                       anomaly_score = score.z,
+                       is_anomaly = score.flag
+                  FROM (VALUES %s) AS score(id, baseline, z, flag)
+                 WHERE line.id = score.id
+            """, SQL(", ").join(SQL("(%s, %s, %s, %s)", *row) for row in chunk)))
+        self.env['isp.bill.line'].invalidate_model(['baseline_amount', 'anomaly_score', 'is_anomaly'])
+        self.invalidate_recordset(['anomaly_count'])
+
+    @api.model
+    def _cron_generate_recurring_bills(self):
+        # Runs daily: bills the services whose recurring_day has come this month
+        today = fields.Date.context_today(self)
+        self._generate_recurring_bills(date_utils.start_of(today, 'month'), date_utils.end_of(today, 'month'), today)
+
+    @api.model
+    def _generate_recurring_bills(self, date_from, date_to, billing_date=None):
+        """ Bill the monthly fee of every active service due by billing_date (default:
+            the end of the period) on the draft recurring bill of its provider for the
+            period, creating the bill when there is none. A service is due once its
+            recurring_day has come, clamped to the last day of the month, and is billed
+            once per period: services already on a recurring bill of the period are
+            skipped, so a service added or activated later is billed on the next run.
+            A service activated during the period is prorated over the bill's total_days.
+            All services are loaded with one query, bills with one create() and lines
+            in batches, so the cost does not grow with one query per service. """
+        billing_date = billing_date or date_to
+        total_days = (date_to - date_from).days + 1
+        # recurring_day 31 in a 30 days month is billed on the last day
+        due_day = 31 if billing_date == date_utils.end_of(billing_date, 'month') else billing_date.day
+
+        billed_services = [
+            service.id for [service] in self.env['isp.bill.line']._read_group([
+                ('bill_id.recurring', '=', True),
+                ('bill_id.date_from', '=', date_from),
+            ], ['service_id'])
+        ]
+        services = self.env['isp.service'].search_fetch([
+            ('id', 'not in', billed_services),
+            ('status', '=', 'active'),
+            ('recurring_day', '>=', 1),
+            ('recurring_day', '<=', due_day),
+            ('monthly_fee', '>', 0),
+            '|', ('active_date', '=', False), ('active_date', '<=', billing_date),
+        ], ['service_provider_id', 'monthly_fee', 'active_date'], order='service_provider_id, id')
+        if not services:
+            return self.browse()
+
+        lines_by_provider = defaultdict(list)
+        currency = self.env.company.currency_id
+        for service in services:
+            billed_days = total_days
+            if service.active_date and service.active_date > date_from:
+                billed_days = (date_to - service.active_date).days + 1
+            lines_by_provider[service.service_provider_id].append({
+                'service_id': service.id,
+                'amount': currency.round(service.monthly_fee * billed_days / total_days),
+            })
+
+        # New lines go on the provider's draft recurring bill of the period, if any
+        bill_by_provider = {}
+        for bill in self.search([
+            ('recurring', '=', True),
+            ('date_from', '=', date_from),
+            ('state', '=', 'draft'),
+            ('provider_id', 'in', [provider.id for provider in lines_by_provider]),
+        ], order='id'):
+            bill_by_provider.setdefault(bill.provider_id, bill)
+
+        period_name = date_from.strftime('%b %Y')
+        new_providers = [provider for provider in lines_by_provider if provider not in bill_by_provider]
+        new_bills = self.create([{
+            'name': f"{provider.name} - {period_name}",
+            'provider_id': provider.id,
+            'period_name': period_name,
+            'date_from': date_from,
+            'date_to': date_to,
+            'total_days': total_days,
+            'recurring': True,
+        } for provider in new_providers])
+        bill_by_provider.update(zip(new_providers, new_bills))
+
+        line_vals = (
+            dict(vals, bill_id=bill_by_provider[provider].id)
+            for provider, vals_list in lines_by_provider.items()
+            for vals in vals_list
+        )
+        for vals_list in split_every(BILL_LINE_BATCH_SIZE, line_vals, list):
+            self.env['isp.bill.line'].create(vals_list)
+
+        bills = self.browse([bill.id for bill in bill_by_provider.values()])
+        _logger.info("ISP recurring billing %s: %s bills (%s new), %s lines",
+                     period_name, len(bills), len(new_bills), len(services))
+        return bills
+
+    @api.depends('line_ids.amount', 'line_ids.service_type_id', 'line_ids.service_type_id.name', 'currency_id')
     def _compute_bill_summary(self):
-        for bill in self:
-            summary_text = ""
-            # Dictionary to store counts and totals
-            # Structure: { 'Service Name': {'count': 0, 'total': 0.0} }
-            stats = {}
-            
+        # Saved bills: one grouped query for all of them,
+        # Structure: { bill_id: [(service type, count, total), ...] }
+        bills = self.filtered(lambda bill: isinstance(bill.id, int))
+        stats = defaultdict(list)
+        if bills:
+            groups = self.env['isp.bill.line']._read_group(
+                [('bill_id', 'in', bills.ids), ('service_type_id', '!=', False)],
+                groupby=['bill_id', 'service_type_id'],
+                aggregates=['__count', 'amount:sum'],
+            )
+            for bill, service_type, count, total in groups:
+                stats[bill.id].append((service_type.name, count, total))
+
+        # Bills being edited in a form are not in the database yet, we sum their lines in Python
+        for bill in self - bills:
+            totals = {}
             for line in bill.line_ids:
                 if not line.service_type_id:
                     continue
-                
-                type_name = line.service_type_id.name
-                if type_name not in stats:
-                    stats[type_name] = {'count': 0, 'total': 0.0}
-                
-                stats[type_name]['count'] += 1
-                stats[type_name]['total'] += line.amount
-            
-            # Build the string: "5 service 5G : 4500 SAR"
-            summary_parts = []
-            for name, data in stats.items():
-                summary_parts.append(f"{data['count']} service {name} : {data['total']:.2f} SAR")
-            
-            bill.summary_notes = "\n".join(summary_parts)
+                count, total = totals.get(line.service_type_id.name, (0, 0.0))
+                totals[line.service_type_id.name] = (count + 1, total + line.amount)
+            stats[bill.id] = [(name, count, total) for name, (count, total) in totals.items()]
+
+        for bill in self:
+            # Build the string: "5 service 5G : 4500.00 SAR"
+            currency = bill.currency_id.name or ''
+            bill.summary_notes = "\n".join(
+                f"{count} service {name} : {total:.2f} {currency}".rstrip()
+                for name, count, total in stats[bill.id]
+            )
 
 class ISPBillLine(models.Model):
     _name = 'isp.bill.line'
     _description = 'ISP Bill Line'
 
-    bill_id = fields.Many2one('isp.bill', ondelete='cascade')
-    service_id = fields.Many2one('isp.service', string="Service / Account", required=True)
+    bill_id = fields.Many2one('isp.bill', ondelete='cascade', index=True)
+    service_id = fields.Many2one('isp.service', string="Service / Account", required=True, index=True)
     
-    # Helpful related fields for the manager to see at a glance
-    billing_account_number = fields.Char(related='service_id.billing_account_number', string="Account No.")
-    line_number = fields.Char(related='service_id.line_number', string="Line No.")
+    # Helpful related fields for the manager to see at a glance.
+    # Stored and indexed so group-by, search and pivot on bill lines run in SQL,
+    # the ORM recomputes them in bulk when the service changes.
+    billing_account_number = fields.Char(related='service_id.billing_account_number', string="Account No.", store=True, index=True)
+    line_number = fields.Char(related='service_id.line_number', string="Line No.", store=True, index=True)
 
     service_type_id = fields.Many2one(
         'isp.service.type', 
         related='service_id.service_type_id', 
-        string="Service Type"
+        string="Service Type",
+        store=True,
+        index=True,
     )
     assign_employee_id = fields.Many2one(
         'hr.employee', 
         related='service_id.assign_employee_id', 
-        string="Assigned Employee"
+        string="Assigned Employee",
+        store=True,
+        index=True,
     )
     branch_id = fields.Many2one(
         'res.company', 
         related='service_id.branch_id', 
-        string="Branch"
+        string="Branch",
+        store=True,
+        index=True,
     )
     assign_department_id = fields.Many2one(
         'hr.department', 
         related='service_id.assign_department_id', 
-        string="Department"
+        string="Department",
+        store=True,
+        index=True,
     )
     
-    amount = fields.Float(string="Amount Due", required=True)
\ No newline at end of file
+    amount = fields.Float(string="Amount Due", required=True)
+
+    # Filled by isp.bill.action_detect_anomalies
+    baseline_amount = fields.Float(string="Usual Amount", readonly=True)
+    anomaly_score = fields.Float(string="Deviation (z)", readonly=True)
+    is_anomaly = fields.Boolean(string="Unusual", readonly=True)
\ No newline at end of file
@@ -0,0 +1,849 @@
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import config
+import io
+import base64
+import binascii
+import pdfplumber
+import openpyxl
+import zipfile
+import csv
+import re
+import os
+import time
+import hashlib
+import logging
+import resource
+import itertools
+import tempfile
+import threading
+import multiprocessing
+from collections import defaultdict, deque
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from markupsafe import Markup
+
+from .isp_bill import BILL_LINE_BATCH_SIZE
+from .isp_service import normalize_line_number, normalize_account_number
+
+_logger = logging.getLogger(__name__)
+
+# Field matched on -> (normalized key stored on isp.service, normalizer)
+LOOKUP_KEYS = {
+    'line_number': ('line_number_key', normalize_line_number),
+    'billing_account_number': ('billing_account_key', normalize_account_number),
+}
+
+# Number of PDF pages a worker process extracts per task
+PDF_PAGES_PER_CHUNK = 20
+
+# System parameter holding the number of PDF extraction processes, 0 to extract in the job's process
+PDF_POOL_SIZE_PARAM = 'ISP_Service_Management.pdf_pool_size'
+PDF_POOL_SIZE_DEFAULT = 2
+
+# Base64 characters decoded per step when spooling an upload (multiple of 4)
+UPLOAD_CHUNK_SIZE = 4 * 256 * 1024
+
+# Runs of a job before it is marked failed: a job still running when the cron starts
+# was interrupted (worker killed by a memory or time limit) and is only resumed this often
+MAX_JOB_ATTEMPTS = 3
+
+# A PDF line position is page index * PDF_PAGE_POSITION_STRIDE + line in page, see _match_pdf_lines
+PDF_PAGE_POSITION_STRIDE = 10000
+
+# Unmatched invoice numbers kept for the report posted on the bill, the rest are only counted
+UNMATCHED_REPORT_LIMIT = 50
+
+# Marks the end of an iterator in ISPImportJob._timed_iter
+_EXHAUSTED = object()
+
+
+def _extract_pdf_pages(path, start, stop, crop_box=None):
+    """ Runs in a worker process: return the text of pages [start, stop),
+        limited to crop_box (x0, top, x1, bottom) when the layout defines one.
+        pdfplumber returns None for pages without text, we return '' instead. """
+    texts = []
+    with pdfplumber.open(path, pages=range(start + 1, stop + 1)) as pdf:
+        for page in pdf.pages:
+            area = page
+            if crop_box:
+                x0, top, x1, bottom = page.bbox
+                area = page.crop((
+                    max(crop_box[0], x0), max(crop_box[1], top),
+                    min(crop_box[2], x1), min(crop_box[3], bottom),
+                ))
+            texts.append(area.extract_text() or '')
+            page.close()
+    return texts
+
+
+class _ThreadZipReader:
+    """ Opens the archive once per worker thread: a ZipFile shared between threads
+        is not safe, its open()/close() bookkeeping runs outside of its lock. """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._archives = []
+
+    def open(self, filename):
+        archive = getattr(self._local, 'archive', None)
+        if archive is None:
+            archive = self._local.archive = zipfile.ZipFile(self.path, 'r')
+            self._archives.append(archive)
+        return archive.open(filename)
+
+    def close(self):
+        for archive in self._archives:
+            archive.close()
+
+
+def _read_zip_member_amount(reader, filename, row_index, col_index, encoding):
+    """ Runs in a worker thread: return (raw amount cell or None, error or None).
+        The CSV is read lazily and we stop as soon as the amount row is reached. """
+    try:
+        with reader.open(filename) as csv_file:
+            # errors='replace' to prevent UnicodeDecodeError
+            content = io.TextIOWrapper(csv_file, encoding=encoding, errors='replace')
+            row = next(itertools.islice(csv.reader(content), row_index, None), None)
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+    return (row[col_index] if row and len(row) > col_index else None), None
+
+
+class ISPImportJob(models.Model):
+    _name = 'isp.import.job'
+    _description = 'ISP Invoice Import Job'
+    _order = 'id desc'
+
+    name = fields.Char(string="Job", required=True)
+    provider_id = fields.Many2one('isp.provider', string="Provider", required=True)
+    period_name = fields.Char(string="Billing Period")
+    date_from = fields.Date(required=True)
+    date_to = fields.Date(required=True)
+    total_days = fields.Integer(string="Total Days")
+
+    file_name = fields.Char(string="File Name")
+    file_data = fields.Binary(string="File", attachment=True)
+    layout_id = fields.Many2one('isp.invoice.layout', string="Invoice Layout", required=True)
+    # SHA-256 of the decoded upload, the job (and its bill) is the parse result for that content
+    content_hash = fields.Char(string="Content Hash", index=True, readonly=True, copy=False)
+
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string="Status", default='queued', required=True)
+    user_id = fields.Many2one('res.users', string="Requested By", default=lambda self: self.env.user)
+    bill_id = fields.Many2one('isp.bill', string="Bill", readonly=True)
+
+    # Progress: checkpoint is the source position (PDF line, ZIP member, CSV row)
+    # of the last committed batch, a restarted job skips everything up to it.
+    checkpoint = fields.Integer(readonly=True)
+    line_count = fields.Integer(string="Imported Lines", readonly=True)
+    total_count = fields.Integer(string="Expected Lines", readonly=True)
+    progress = fields.Float(compute='_compute_progress')
+
+    attempt_count = fields.Integer(string="Attempts", readonly=True, copy=False)
+    date_started = fields.Datetime(readonly=True)
+    date_finished = fields.Datetime(readonly=True)
+    error_message = fields.Text(readonly=True)
+    log_ids = fields.One2many('isp.import.log', 'job_id', string="Timings", readonly=True)
+
+    @api.depends('line_count', 'total_count', 'state')
+    def _compute_progress(self):
+        for job in self:
+            if job.state == 'done':
+                job.progress = 100.0
+            elif job.total_count:
+                job.progress = min(100.0, 100.0 * job.line_count / job.total_count)
+            else:
+                job.progress = 0.0
+
+    def action_retry(self):
+        self.filtered(lambda job: job.state == 'failed').write({
+            'state': 'queued',
+            'error_message': False,
+            'attempt_count': 0,
+        })
+        self.env.ref('ISP_Service_Management.ir_cron_isp_import_jobs')._trigger()
+
+    def _compute_content_hash(self):
+        """ Hash the upload from the filestore in UPLOAD_CHUNK_SIZE blocks, without parsing it """
+        for job in self:
+            digest = hashlib.sha256()
+            with job._upload_path() as path, open(path, 'rb') as upload_file:
+                for block in iter(lambda: upload_file.read(UPLOAD_CHUNK_SIZE), b''):
+                    digest.update(block)
+            job.content_hash = digest.hexdigest()
+
+    def _find_duplicate(self):
+        """ Return the bill or the pending job already built from the same content
+            for the same provider, or None. Failed jobs do not count: their bill only
+            gets the content hash when the job is done. """
+        self.ensure_one()
+        if not self.content_hash:
+            return None
+        bill = self.env['isp.bill'].search([
+            ('content_hash', '=', self.content_hash),
+            ('provider_id', '=', self.provider_id.id),
+        ], limit=1)
+        if bill:
+            return bill
+        job = self.search([
+            ('id', '!=', self.id),
+            ('content_hash', '=', self.content_hash),
+            ('provider_id', '=', self.provider_id.id),
+            ('state', 'in', ('queued', 'running')),
+        ], limit=1)
+        return job or None
+
+    @api.model
+    def _cron_process_jobs(self):
+        # ir.cron runs a given cron on one worker at a time, so a job still 'running'
+        # here was interrupted (worker restart, timeout) and is resumed from its checkpoint.
+        for job in self.search([('state', 'in', ('queued', 'running'))], order='id'):
+            if job.attempt_count >= MAX_JOB_ATTEMPTS:
+                _logger.warning("ISP import job %s: interrupted %s times, giving up", job.name, job.attempt_count)
+                job.write({
+                    'state': 'failed',
+                    'error_message': "The import was interrupted %s times (worker memory or time limit?)." % job.attempt_count,
+                })
+                self.env.cr.commit()
+                continue
+            job._process()
+
+    def _process(self):
+        self.ensure_one()
+        _logger.info("ISP import job %s: starting at checkpoint %s", self.name, self.checkpoint)
+        # Counted before running, so a run killed with its worker still counts
+        self.write({
+            'state': 'running',
+            'date_started': self.date_started or fields.Datetime.now(),
+            'attempt_count': self.attempt_count + 1,
+        })
+        self.env.cr.commit()
+        try:
+            self._run_import()
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.exception("ISP import job %s failed", self.name)
+            self.write({'state': 'failed', 'error_message': str(e)})
+        else:
+            self.write({'state': 'done', 'date_finished': fields.Datetime.now()})
+            # Only a complete bill stands for the file, see _find_duplicate
+            self.bill_id.content_hash = self.content_hash
+        self.env.cr.commit()
+
+    def _run_import(self):
+        # The parser is chosen by the provider's layout, compiled once per worker
+        template = self.env['isp.invoice.layout']._find_template(self.provider_id.id, layout_id=self.layout_id.id)
+        if not template:
+            raise UserError("The invoice layout %s is not available for provider %s." % (
+                self.layout_id.display_name, self.provider_id.name))
+        return getattr(self, '_import_from_%s' % template.file_type)(template)
+
+    @contextmanager
+    def _phase(self, phase, nested=()):
+        """ Record the wrapped block as an isp.import.log entry: wall time, SQL queries,
+            rows handled (set stats['rows'] in the block) and the worker's peak memory.
+
+            Phases that run interleaved with this one (a generator consumed by the block)
+            are measured by _timed_iter into the nested stats: they are logged first and
+            their time and queries are not counted twice. """
+        stats = self._phase_stats(phase)
+        start, queries = time.perf_counter(), self.env.cr.sql_log_count
+        yield stats
+        stats['duration'] = time.perf_counter() - start
+        stats['queries'] = self.env.cr.sql_log_count - queries
+        for inner in nested:
+            stats['duration'] -= inner['duration']
+            stats['queries'] -= inner['queries']
+            self._log_phase(inner)
+        self._log_phase(stats)
+
+    def _phase_stats(self, phase):
+        return {'phase': phase, 'duration': 0.0, 'queries': 0, 'rows': 0}
+
+    def _timed_iter(self, iterable, stats, inner=None):
+        """ Yield the items of iterable, adding the time and queries spent producing
+            them to stats. inner is the stats of an iterable wrapped in it, whose
+            share is left out. """
+        iterator = iter(iterable)
+        while True:
+            start, queries = time.perf_counter(), self.env.cr.sql_log_count
+            inner_duration, inner_queries = (inner['duration'], inner['queries']) if inner else (0.0, 0)
+            item = next(iterator, _EXHAUSTED)
+            stats['duration'] += time.perf_counter() - start
+            stats['queries'] += self.env.cr.sql_log_count - queries
+            if inner:
+                stats['duration'] -= inner['duration'] - inner_duration
+                stats['queries'] -= inner['queries'] - inner_queries
+            if item is _EXHAUSTED:
+                return
+            stats['rows'] += 1
+            yield item
+
+    def _log_phase(self, stats):
+        # ru_maxrss is in KiB on Linux
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        _logger.info(
+            "isp_import job=%s phase=%s duration=%.3f queries=%s rows=%s peak_memory_mb=%.1f",
+            self.id, stats['phase'], stats['duration'], stats['queries'], stats['rows'], peak_memory,
+        )
+        self.env['isp.import.log'].create({
+            'job_id': self.id,
+            'phase': stats['phase'],
+            'duration': stats['duration'],
+            'query_count': stats['queries'],
+            'row_count': stats['rows'],
+            'peak_memory': peak_memory,
+        })
+
+    @contextmanager
+    def _decoded_upload(self):
+        """ _upload_path, timed as the 'decode' phase """
+        with ExitStack() as stack:
+            with self._phase('decode'):
+                path = stack.enter_context(self._upload_path())
+            yield path
+
+    def _import_from_pdf(self, template):
+        """ Extract, match and create the lines in one stream: each batch of lines is
+            committed while the rest of the PDF is still being extracted. A resumed job
+            restarts the extraction at the page of its checkpoint, the services already
+            on the bill are not billed again (only the first occurrence of a number is). """
+        bill = self._get_or_create_bill()
+        index = self._get_service_index(template.match_field)
+        # At most one line per service, the job is done before reaching it when
+        # some services are not in the invoice
+        self.total_count = sum(len(service_ids) for service_ids in index.values())
+        report = {
+            'seen_keys': self._get_billed_keys(template.match_field),
+            'unmatched_numbers': [],
+            'unmatched_count': 0,
+        }
+
+        with self._decoded_upload() as pdf_path:
+            extract = self._phase_stats('extract')
+            match = self._phase_stats('match')
+            with self._phase('create', nested=[extract, match]) as stats:
+                lines = self._timed_iter(self._iter_pdf_lines(
+                    pdf_path, template.crop_box, start_page=self.checkpoint // PDF_PAGE_POSITION_STRIDE), extract)
+                matches = self._timed_iter(self._match_pdf_lines(lines, template, index, report), match, inner=extract)
+                self._create_bill_lines(
+                    (position, {'service_id': service_id, 'amount': due_amount})
+                    for position, service_id, due_amount in matches
+                )
+                stats['rows'] = match['rows']
+
+        unmatched_services = self.env['isp.service'].browse([
+            service_id
+            for key, service_ids in index.items() if key not in report['seen_keys']
+            for service_id in service_ids
+        ])
+        self._report_unmatched(bill, unmatched_services, report['unmatched_numbers'], report['unmatched_count'])
+        return bill
+
+    def _get_billed_keys(self, field_name):
+        """ Lookup keys of the services already on the job's bill, i.e. committed by a previous run """
+        if not self.checkpoint:
+            return set()
+        key_field = LOOKUP_KEYS[field_name][0]
+        services = self.env['isp.service'].browse([
+            service.id for [service] in self.env['isp.bill.line']._read_group(
+                [('bill_id', '=', self.bill_id.id)], ['service_id'])
+        ])
+        return set(services.mapped(key_field))
+
+    def _get_pdf_pool_size(self, chunk_count):
+        """ Number of processes extracting the PDF pages, 0 to extract them in this process.
+            The pool is forked, which is only safe from a prefork worker: a threaded server
+            would fork a multithreaded process, and a child could inherit a lock held by
+            another thread. The children never use the inherited database connection, and
+            multiprocessing ends them with os._exit() so it is not closed either. """
+        if not config['workers']:
+            return 0
+        pool_size = self.env['ir.config_parameter'].sudo().get_param(PDF_POOL_SIZE_PARAM, PDF_POOL_SIZE_DEFAULT)
+        try:
+            pool_size = int(pool_size)
+        except ValueError:
+            _logger.warning("Invalid %s %r, extracting the PDF in process", PDF_POOL_SIZE_PARAM, pool_size)
+            return 0
+        return min(max(pool_size, 0), chunk_count)
+
+    def _iter_pdf_lines(self, path, crop_box=None, start_page=0):
+        """ Yield (page index, text line) for the lines of the PDF in page order, from start_page.
+            Pages are extracted in chunks of PDF_PAGES_PER_CHUNK, by a process pool in
+            prefork workers (see _get_pdf_pool_size), with only a few chunks in flight,
+            so the whole text is never held at once. """
+        try:
+            with pdfplumber.open(path) as pdf:
+                page_count = len(pdf.pages)
+        except Exception:
+            raise UserError("Could not read the PDF file.")
+
+        ranges = iter([
+            (start, min(start + PDF_PAGES_PER_CHUNK, page_count))
+            for start in range(start_page, page_count, PDF_PAGES_PER_CHUNK)
+        ])
+        workers = self._get_pdf_pool_size(-(-(page_count - start_page) // PDF_PAGES_PER_CHUNK))
+
+        if workers <= 1:
+            for start, stop in ranges:
+                for page_index, text in enumerate(_extract_pdf_pages(path, start, stop, crop_box), start=start):
+                    for line in text.splitlines():
+                        yield page_index, line
+            return
+
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        try:
+            futures = deque(
+                (start, executor.submit(_extract_pdf_pages, path, start, stop, crop_box))
+                for start, stop in itertools.islice(ranges, workers * 2)
+            )
+            while futures:
+                start, future = futures.popleft()
+                texts = future.result()
+                next_range = next(ranges, None)
+                if next_range:
+                    futures.append((next_range[0], executor.submit(_extract_pdf_pages, path, *next_range, crop_box)))
+                for page_index, text in enumerate(texts, start=start):
+                    for line in text.splitlines():
+                        yield page_index, line
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _match_pdf_lines(self, lines, template, index, report):
+        """ Walk the (page index, text) lines a single time and pair every service number
+            line with the amount found template.amount_line_offset lines below it.
+            Yields (position, service id, amount), position being the page index times
+            PDF_PAGE_POSITION_STRIDE plus the line of the number in its page, so that a
+            checkpoint tells on which page to resume. report is updated in place:
+            seen_keys (the numbers found), unmatched_numbers (the first
+            UNMATCHED_REPORT_LIMIT unknown numbers) and unmatched_count. """
+        normalize = LOOKUP_KEYS[template.match_field][1]
+        seen_keys = report['seen_keys']
+        unmatched_keys = set()
+        pending = defaultdict(list)  # amount line counter -> [(number line position, key)]
+
+        page, line_in_page = None, 0
+        for counter, (page_index, line) in enumerate(lines, start=1):
+            if page_index != page:
+                page, line_in_page = page_index, 0
+            line_in_page += 1
+            if line_in_page >= PDF_PAGE_POSITION_STRIDE:
+                raise UserError("Page %s of the PDF has more than %s lines." % (page_index + 1, PDF_PAGE_POSITION_STRIDE))
+            position = page_index * PDF_PAGE_POSITION_STRIDE + line_in_page
+            text = (line or '').strip()
+
+            # The amounts are below the number, e.g. "0.00 138.00 ..." on the VERY NEXT line
+            for number_position, key in pending.pop(counter, ()):
+                try:
+                    due_amount = self._parse_pdf_amount(text, template)
+                except ValueError as e:
+                    _logger.warning("Could not parse amount on line %s for %s: %s", number_position, key, e)
+                    continue
+                for service_id in index[key]:
+                    yield number_position, service_id, due_amount
+
+            # A service number line is short, no need to normalize whole sentences
+            key = normalize(text) if len(text) <= 32 else ''
+            if key in index:
+                # Only the first occurrence of a service number is billed
+                if key not in seen_keys:
+                    seen_keys.add(key)
+                    pending[counter + template.amount_line_offset].append((position, key))
+            elif template.number_re.match(text) and key not in unmatched_keys:
+                report['unmatched_count'] += 1
+                if len(report['unmatched_numbers']) < UNMATCHED_REPORT_LIMIT:
+                    unmatched_keys.add(key)
+                    report['unmatched_numbers'].append(text)
+
+    def _parse_pdf_amount(self, text, template):
+        """ The due amount is the first group of the layout's amount pattern,
+            e.g. the 2nd value 138.00 in "0.00 138.00 ..." """
+        match = template.amount_re.search(text)
+        if not match:
+            raise ValueError("no amount in %r" % text)
+        return self._parse_amount(match.group(1) if match.groups() else match.group(0))
+
+    def _parse_amount(self, raw_amount):
+        # XLSX cells are already numbers
+        if isinstance(raw_amount, (int, float)):
+            return float(raw_amount)
+        # Clean numeric data (remove commas or currency symbols)
+        clean_amount = re.sub(r'[^\d.]', '', raw_amount or '')
+        return float(clean_amount) if clean_amount else 0.0
+
+    def _report_unmatched(self, bill, unmatched_services, unmatched_numbers, unmatched_count=None,
+                          limit=UNMATCHED_REPORT_LIMIT):
+        """ Log and post on the bill which services were not found in the invoice
+            and which invoice numbers have no service in Odoo. unmatched_count is the
+            number of unmatched invoice numbers when only the first ones were kept. """
+        unmatched_count = max(unmatched_count or 0, len(unmatched_numbers))
+        _logger.info(
+            "ISP import %s: %s lines imported, %s services not in invoice, %s invoice numbers without service",
+            bill.name, self.line_count, len(unmatched_services), unmatched_count,
+        )
+        if not unmatched_services and not unmatched_count:
+            return
+
+        def _format(values, count):
+            values = list(values)
+            text = ", ".join(values[:limit])
+            if count > min(len(values), limit):
+                text += " ... (+%s more)" % (count - min(len(values), limit))
+            return text
+
+        body = []
+        if unmatched_services:
+            body.append("Services not found in the invoice (%s): %s" % (
+                len(unmatched_services), _format(unmatched_services.mapped('line_number'), len(unmatched_services))))
+        if unmatched_count:
+            body.append("Invoice numbers without a matching service (%s): %s" % (
+                unmatched_count, _format(unmatched_numbers, unmatched_count)))
+        bill.message_post(body=Markup('<br/>').join(body))
+
+    def _import_from_zip(self, template):
+        """ Read, match and create the lines in one stream: each batch of lines is
+            committed while the other account files are still being read, and a
+            resumed job does not read the files before its checkpoint again. """
+        bill = self._get_or_create_bill()
+        # One search for the whole archive: billing_account_number -> services
+        services_by_account = self._get_service_index(template.match_field)
+        normalize = LOOKUP_KEYS[template.match_field][1]
+        failures = []
+
+        def _line_vals(amounts):
+            for position, filename, number, raw_amount, error in amounts:
+                if error:
+                    _logger.warning("Error reading CSV rows in %s: %s", filename, error)
+                    failures.append("%s: %s" % (filename, error))
+                # After a failure the files are still read to report all of them, but no
+                # line is created, so the checkpoint stays before the first unreadable file
+                if failures:
+                    continue
+                if raw_amount is None:
+                    _logger.warning("Skipping %s: no amount on row %s", filename, template.amount_row + 1)
+                    continue
+                try:
+                    due_amount = self._parse_amount(raw_amount)
+                except ValueError:
+                    due_amount = 0.0
+
+                # Find services matching this Billing Account Number
+                for service_id in services_by_account.get(normalize(number), []):
+                    yield position, {
+                        'service_id': service_id,
+                        'amount': due_amount,
+                    }
+
+        with self._decoded_upload() as zip_path:
+            with self._open_zip(zip_path) as z:
+                members = self._list_zip_members(z, template)
+            self.total_count = sum(len(services_by_account.get(normalize(number), ())) for _filename, number in members)
+
+            extract = self._phase_stats('extract')
+            match = self._phase_stats('match')
+            with self._phase('create', nested=[extract, match]) as stats:
+                amounts = self._timed_iter(self._iter_zip_amounts(zip_path, members, template), extract)
+                self._create_bill_lines(self._timed_iter(_line_vals(amounts), match, inner=extract))
+                stats['rows'] = match['rows']
+
+        # An unreadable account file would silently leave its services unbilled
+        if failures:
+            raise UserError("Could not read %s of the %s CSV files of the archive:\n%s" % (
+                len(failures), len(members), "\n".join(failures[:20])))
+        _logger.info("ISP import %s: %s CSV files read, %s lines imported", bill.name, len(members), self.line_count)
+        return bill
+
+    def _list_zip_members(self, z, template):
+        """ Return [(filename, number)] for the account CSV files of the archive """
+        members = []
+        for filename in z.namelist():
+            # Process only CSV files and ignore MacOS system files
+            if not filename.endswith('.csv') or filename.startswith('__MACOSX'):
+                continue
+            # Use os.path.basename to get just the filename if it's inside a folder
+            numbers = [
+                match.group(1) if match.groups() else match.group(0)
+                for match in template.member_re.finditer(os.path.basename(filename))
+            ]
+            if not numbers:
+                _logger.warning("Skipping %s: no account or line number in the file name", filename)
+                continue
+            members.append((filename, numbers[-1]))
+        return members
+
+    def _iter_zip_amounts(self, zip_path, members, template):
+        """ Yield (position, filename, number, raw_amount, error) for the members after
+            the job's checkpoint, position being the 1-based index of the member,
+            raw_amount None when the CSV has no amount cell, error the reason the
+            CSV could not be read. """
+        remaining = [
+            (position, filename, number)
+            for position, (filename, number) in enumerate(members, start=1)
+            if position > self.checkpoint
+        ]
+        # The members are decompressed and parsed concurrently, each thread
+        # reading through its own handle on the archive.
+        reader = _ThreadZipReader(zip_path)
+        try:
+            with ThreadPoolExecutor() as executor:
+                results = executor.map(
+                    lambda member: _read_zip_member_amount(
+                        reader, member[1], template.amount_row, template.amount_col, template.encoding),
+                    remaining)
+                for (position, filename, number), (raw_amount, error) in zip(remaining, results):
+                    yield position, filename, number, raw_amount, error
+        finally:
+            reader.close()
+
+    def _import_from_csv(self, template):
+        return self._import_from_rows(template, self._iter_csv_rows, self._count_csv_rows)
+
+    def _import_from_xlsx(self, template):
+        return self._import_from_rows(template, self._iter_xlsx_rows, self._count_xlsx_rows)
+
+    def _import_from_rows(self, template, iter_rows, count_rows):
+        """ Stream the rows of a CSV or XLSX file and create one bill line per row,
+            using the column mapping of the provider's layout. Rows are read through
+            iter_rows(path, template), a generator of (number, raw_amount), and lines
+            are inserted in batches (count_rows(path) gives the expected lines for the
+            progress), so memory stays flat whatever the file size: only
+            the matched keys (at most one per service) and the first unmatched numbers
+            are kept for the report, the other unmatched rows are only counted. """
+        bill = self._get_or_create_bill()
+
+        services_by_key = {}
+        normalize = LOOKUP_KEYS[template.match_field][1]
+        seen_keys = set()
+        unmatched_keys = set()
+        unmatched_numbers = []
+        unmatched = {'count': 0}
+
+        def _line_vals(rows):
+            # Loaded on the first row, so that the search is timed with the match phase
+            services_by_key.update(self._get_service_index(template.match_field))
+            for position, (number, raw_amount) in enumerate(rows, start=1):
+                key = normalize(number)
+                service_ids = services_by_key.get(key)
+                if not service_ids:
+                    if key in unmatched_keys:
+                        continue
+                    # Past the limit, repeated unknown numbers are counted again
+                    unmatched['count'] += 1
+                    if len(unmatched_numbers) < UNMATCHED_REPORT_LIMIT:
+                        unmatched_keys.add(key)
+                        unmatched_numbers.append(number)
+                    continue
+                seen_keys.add(key)
+                try:
+                    due_amount = self._parse_amount(raw_amount)
+                except ValueError:
+                    _logger.warning("Could not parse amount %r for %s", raw_amount, number)
+                    continue
+                for service_id in service_ids:
+                    yield position, {'service_id': service_id, 'amount': due_amount}
+
+        # Reading, matching and creation are interleaved: the rows and line values are
+        # generators, timed separately from the create phase that consumes them
+        with self._decoded_upload() as path:
+            self.total_count = count_rows(path)
+            extract = self._phase_stats('extract')
+            match = self._phase_stats('match')
+            with self._phase('create', nested=[extract, match]) as stats:
+                rows = self._timed_iter(iter_rows(path, template), extract)
+                self._create_bill_lines(self._timed_iter(_line_vals(rows), match, inner=extract))
+                stats['rows'] = match['rows']
+
+        unmatched_services = self.env['isp.service'].browse([
+            service_id
+            for key, service_ids in services_by_key.items() if key not in seen_keys
+            for service_id in service_ids
+        ])
+        self._report_unmatched(bill, unmatched_services, unmatched_numbers, unmatched['count'])
+        return bill
+
+    def _iter_csv_rows(self, path, template):
+        """ Yield (number, raw_amount) for every data row of the CSV file """
+        key_column = template.key_column
+        amount_column = template.amount_column
+        try:
+            csv_file = open(path, newline='', encoding=template.encoding, errors='replace')
+        except LookupError:
+            raise UserError("Unknown CSV encoding %r on invoice layout %s." % (template.encoding, template.name))
+
+        with csv_file:
+            reader = csv.DictReader(csv_file, delimiter=template.delimiter)
+            missing = {key_column, amount_column} - set(reader.fieldnames or [])
+            if missing:
+                raise UserError("Columns %s not found in the CSV file. Check the invoice layout %s." % (
+                    ", ".join(sorted(missing)), template.name))
+            for row in reader:
+                key = (row[key_column] or '').strip()
+                if key:
+                    yield key, row[amount_column]
+
+    def _count_csv_rows(self, path):
+        """ Number of data rows of the CSV file, counted from its line breaks without parsing it """
+        with open(path, 'rb') as csv_file:
+            breaks = sum(block.count(b'\n') for block in iter(lambda: csv_file.read(UPLOAD_CHUNK_SIZE), b''))
+        return max(breaks - 1, 0)
+
+    def _count_xlsx_rows(self, path):
+        """ Number of data rows of the first sheet, from the dimension stored in the workbook """
+        try:
+            workbook = openpyxl.load_workbook(path, read_only=True)
+        except (zipfile.BadZipFile, KeyError, ValueError):
+            return 0
+        try:
+            return max((workbook.active.max_row or 1) - 1, 0)
+        finally:
+            workbook.close()
+
+    def _iter_xlsx_rows(self, path, template):
+        """ Yield (number, raw_amount) for every data row of the first sheet.
+            The workbook is opened read-only, openpyxl then streams the rows
+            from the archive instead of loading the whole sheet. """
+        try:
+            workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            raise UserError("The uploaded file is not a valid XLSX workbook: %s" % e)
+
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+            missing = {template.key_column, template.amount_column} - set(header)
+            if missing:
+                raise UserError("Columns %s not found in the XLSX file. Check the invoice layout %s." % (
+                    ", ".join(sorted(missing)), template.name))
+            key_index = header.index(template.key_column)
+            amount_index = header.index(template.amount_column)
+            for row in rows:
+                if len(row) <= max(key_index, amount_index):
+                    continue
+                key = row[key_index]
+                # Numbers typed in Excel come back as int/float, 5.0 must give "5"
+                if isinstance(key, float) and key.is_integer():
+                    key = int(key)
+                key = str(key).strip() if key is not None else ''
+                if key:
+                    yield key, row[amount_index]
+        finally:
+            workbook.close()
+
+    def _get_service_index(self, field_name):
+        """ Load the provider's services once: normalized field value -> service ids.
+            The keys are the indexed lookup keys stored on isp.service, the numbers
+            read from a file must go through the same normalizer (see LOOKUP_KEYS). """
+        key_field = LOOKUP_KEYS[field_name][0]
+        index = defaultdict(list)
+        services = self.env['isp.service'].search_fetch([
+            ('service_provider_id', '=', self.provider_id.id),
+            (key_field, '!=', False),
+        ], [key_field])
+        for service in services:
+            index[service[key_field]].append(service.id)
+        return index
+
+    @contextmanager
+    def _upload_path(self):
+        """ Yield a filesystem path to the uploaded file without loading it in memory.
+            The upload is stored as an ir.attachment, so we read it from the filestore
+            directly and only spool it to a temporary file when it is kept in the database. """
+        self.ensure_one()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'file_data'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if attachment.store_fname:
+            yield attachment._full_path(attachment.store_fname)
+            return
+
+        suffix = os.path.splitext(self.file_name or '')[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix) as upload_file:
+            if attachment:
+                upload_file.write(attachment.raw)
+            else:
+                try:
+                    self._spool_base64(self.file_data, upload_file)
+                except (ValueError, binascii.Error):
+                    raise UserError("Could not decode the uploaded file.")
+            upload_file.flush()
+            yield upload_file.name
+
+    def _spool_base64(self, data, upload_file):
+        """ Decode base64 data into upload_file UPLOAD_CHUNK_SIZE characters at a time """
+        for start in range(0, len(data or b''), UPLOAD_CHUNK_SIZE):
+            upload_file.write(base64.b64decode(data[start:start + UPLOAD_CHUNK_SIZE]))
+
+    def _open_zip(self, zip_path):
+        try:
+            return zipfile.ZipFile(zip_path, 'r')
+        except (zipfile.BadZipFile, OSError):
+            raise UserError("Could not decode the ZIP file.")
+
+    def _create_bill_lines(self, rows):
+        """ Create the bill lines from (position, vals) rows with one create() per
+            BILL_LINE_BATCH_SIZE lines, committing after each batch together with the
+            job checkpoint. Rows at or before the checkpoint were committed by a previous
+            run and are skipped. Batches only end between positions, so the lines of
+            one position (e.g. all services of an account) are committed together. """
+        start_checkpoint = self.checkpoint
+        batch = []
+        last_position = start_checkpoint
+        for position, vals in rows:
+            if position <= start_checkpoint:
+                continue
+            if position != last_position and len(batch) >= BILL_LINE_BATCH_SIZE:
+                self._flush_bill_lines(batch, last_position)
+                batch = []
+            vals['bill_id'] = self.bill_id.id
+            batch.append(vals)
+            last_position = position
+        if batch:
+            self._flush_bill_lines(batch, last_position)
+
+    def _flush_bill_lines(self, vals_list, position):
+        self.env['isp.bill.line'].create(vals_list)
+        self.write({
+            'checkpoint': position,
+            'line_count': self.line_count + len(vals_list),
+        })
+        self.env.cr.commit()
+        # The committed lines would otherwise stay in the cache until the end of the import
+        self.env.invalidate_all()
+
+    def _get_or_create_bill(self):
+        """ Return the bill of the job, creating it on the first run """
+        if not self.bill_id:
+            bill = self.env['isp.bill'].create({
+                'name': os.path.splitext(self.file_name)[0],
+                'provider_id': self.provider_id.id,
+                'period_name': self.period_name,
+                'date_from': self.date_from,
+                'date_to': self.date_to,
+                'total_days': self.total_days,
+            })
+            self.bill_id = bill
+            self.env.cr.commit()
+        return self.bill_id
+
+
+class ISPImportLog(models.Model):
+    _name = 'isp.import.log'
+    _description = 'ISP Import Phase Timing'
+    _order = 'id'
+
+    job_id = fields.Many2one('isp.import.job', required=True, ondelete='cascade')
+    phase = fields.Char(required=True)
+    duration = fields.Float(string="Duration (s)", digits=(16, 3))
+    query_count = fields.Integer(string="Queries")
+    row_count = fields.Integer(string="Rows")
+    peak_memory = fields.Float(string="Peak Memory (MB)", digits=(16, 1),
+                               help="Peak resident memory of the worker process at the end of the phase")
@@ -0,0 +1,140 @@
+import re
+from collections import namedtuple
+
+from odoo import models, fields, api, tools
+from odoo.exceptions import ValidationError
+
+# A layout compiled once per worker, see ISPInvoiceLayout._get_provider_templates
+InvoiceTemplate = namedtuple('InvoiceTemplate', [
+    'id', 'name', 'file_type', 'match_field', 'file_name_re',
+    # PDF
+    'number_re', 'amount_re', 'amount_line_offset', 'crop_box',
+    # ZIP
+    'member_re', 'amount_row', 'amount_col',
+    # CSV / XLSX
+    'key_column', 'amount_column', 'delimiter',
+    'encoding',
+])
+
+
+class ISPInvoiceLayout(models.Model):
+    _name = 'isp.invoice.layout'
+    _description = 'ISP Invoice Layout'
+    _order = 'sequence, id'
+
+    name = fields.Char(required=True)
+    sequence = fields.Integer(default=10)
+    active = fields.Boolean(default=True)
+    provider_id = fields.Many2one('isp.provider', string="Provider", ondelete='cascade',
+                                  help="Leave empty to use this layout for every provider without a matching layout")
+    file_type = fields.Selection([
+        ('pdf', 'PDF'),
+        ('zip', 'ZIP of CSV files'),
+        ('csv', 'CSV'),
+        ('xlsx', 'Excel (XLSX)'),
+    ], string="Parser", required=True, default='pdf')
+    file_name_pattern = fields.Char(string="File Name Pattern", required=True, default=r'\.pdf$',
+                                    help="Regular expression on the uploaded file name selecting this layout")
+    match_field = fields.Selection([
+        ('line_number', 'Line Number'),
+        ('billing_account_number', 'Billing Account Number'),
+    ], string="Match Services On", default='line_number', required=True)
+    encoding = fields.Char(default='utf-8-sig', help="Encoding of the CSV files")
+
+    # PDF: a service number line, and the amount a few lines below it
+    pdf_number_pattern = fields.Char(string="Number Line Pattern", default=r'^\+?\d[\d\s-]{5,}$',
+                                     help="Regular expression of a line holding only a service number")
+    pdf_amount_pattern = fields.Char(string="Amount Pattern", default=r'^\S+\s+(\S+)',
+                                     help="Regular expression on the amount line, the first group is the amount")
+    pdf_amount_line_offset = fields.Integer(string="Amount Line Offset", default=1,
+                                            help="Number of lines between the service number and its amount")
+    pdf_crop_box = fields.Char(string="Crop Box",
+                               help="Only read this area of each page: x0, top, x1, bottom in PDF points")
+
+    # ZIP: one CSV per account, the amount in a fixed cell
+    zip_member_pattern = fields.Char(string="Member Pattern", default=r'ACT[\s_-]*(\d[\d-]*)',
+                                     help="Regular expression on the CSV file names, the first group is the number")
+    zip_amount_row = fields.Integer(string="Amount Row", default=14)
+    zip_amount_col = fields.Integer(string="Amount Column", default=1)
+
+    # CSV / XLSX: one row per line, mapped by header (first sheet for XLSX)
+    csv_key_column = fields.Char(string="Number Column", default='line_number',
+                                 help='Header of the column holding the line or account number')
+    csv_amount_column = fields.Char(string="Amount Column", default='amount',
+                                    help='Header of the column holding the amount due')
+    csv_delimiter = fields.Char(string="Delimiter", default=',', size=1)
+
+    @api.constrains('file_name_pattern', 'pdf_number_pattern', 'pdf_amount_pattern', 'zip_member_pattern', 'pdf_crop_box')
+    def _check_patterns(self):
+        for layout in self:
+            for field_name in ('file_name_pattern', 'pdf_number_pattern', 'pdf_amount_pattern', 'zip_member_pattern'):
+                try:
+                    re.compile(layout[field_name] or '')
+                except re.error as e:
+                    raise ValidationError("Invalid %s on layout %s: %s" % (
+                        layout._fields[field_name].string, layout.name, e))
+            try:
+                layout._parse_crop_box()
+            except ValueError:
+                raise ValidationError("The crop box of layout %s must be 4 numbers: x0, top, x1, bottom." % layout.name)
+
+    def _parse_crop_box(self):
+        if not self.pdf_crop_box:
+            return None
+        box = tuple(float(value) for value in self.pdf_crop_box.split(','))
+        if len(box) != 4:
+            raise ValueError(self.pdf_crop_box)
+        return box
+
+    def _compile(self):
+        self.ensure_one()
+        return InvoiceTemplate(
+            id=self.id,
+            name=self.name,
+            file_type=self.file_type,
+            match_field=self.match_field,
+            file_name_re=re.compile(self.file_name_pattern, re.IGNORECASE),
+            number_re=re.compile(self.pdf_number_pattern or '(?!)'),
+            amount_re=re.compile(self.pdf_amount_pattern or r'(\S+)'),
+            amount_line_offset=max(self.pdf_amount_line_offset, 1),
+            crop_box=self._parse_crop_box(),
+            member_re=re.compile(self.zip_member_pattern or '(?!)', re.IGNORECASE),
+            amount_row=max(self.zip_amount_row, 1) - 1,
+            amount_col=max(self.zip_amount_col, 1) - 1,
+            key_column=self.csv_key_column,
+            amount_column=self.csv_amount_column,
+            delimiter=self.csv_delimiter or ',',
+            encoding=self.encoding or 'utf-8-sig',
+        )
+
+    @api.model
+    @tools.ormcache('provider_id')
+    def _get_provider_templates(self, provider_id):
+        """ The compiled layouts of the provider, then the global ones.
+            Cached per worker until a layout is changed. """
+        layouts = self.sudo().search([('provider_id', 'in', [provider_id, False])])
+        layouts = layouts.sorted(lambda layout: (not layout.provider_id, layout.sequence, layout.id))
+        return tuple(layout._compile() for layout in layouts)
+
+    @api.model
+    def _find_template(self, provider_id, file_name=None, layout_id=None):
+        """ Return the compiled layout of the provider for this file name (or layout id), or None """
+        for template in self._get_provider_templates(provider_id):
+            if layout_id and template.id == layout_id:
+                return template
+            if not layout_id and template.file_name_re.search(file_name or ''):
+                return template
+        return None
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env.registry.clear_cache()
+        return super(ISPInvoiceLayout, self).create(vals_list)
+
+    def write(self, vals):
+        self.env.registry.clear_cache()
+        return super(ISPInvoiceLayout, self).write(vals)
+
+    def unlink(self):
+        self.env.registry.clear_cache()
+        return super(ISPInvoiceLayout, self).unlink()
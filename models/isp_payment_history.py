@@ -30,4 +30,28 @@ class ISPPaymentHistory(models.Model):
     @api.depends('service_id.assign_department_id')
     def _compute_department(self):
         for rec in self:
-            rec.department_id = rec.service_id.assign_department_id
\ No newline at end of file
+            rec.department_id = rec.service_id.assign_department_id
+
+    # Fields aggregated by isp.spend.report
+    _SPEND_FIELDS = {'service_id', 'department_id', 'currency_id', 'amount', 'date_from'}
+
+    def _spend_months(self):
+        return {rec.date_from.replace(day=1) for rec in self if rec.date_from}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(ISPPaymentHistory, self).create(vals_list)
+        self.env['isp.spend.report']._schedule_refresh(records._spend_months())
+        return records
+
+    def write(self, vals):
+        if not self._SPEND_FIELDS.intersection(vals):
+            return super(ISPPaymentHistory, self).write(vals)
+        months = self._spend_months()
+        res = super(ISPPaymentHistory, self).write(vals)
+        self.env['isp.spend.report']._schedule_refresh(months | self._spend_months())
+        return res
+
+    def unlink(self):
+        self.env['isp.spend.report']._schedule_refresh(self._spend_months())
+        return super(ISPPaymentHistory, self).unlink()
@@ -9,6 +9,7 @@ class PaymentRequest(models.Model):
     requesting_department = fields.Many2one('hr.department', string='Requesting Department')
     beneficiary = fields.Many2one('isp.provider', string='Beneficiary')
     bill_id = fields.Many2one('isp.bill', string="Related Bill", tracking=True)
+    bill_anomaly_count = fields.Integer(related='bill_id.anomaly_count', string="Unusual Amounts")
     # if the user seelct the bill the system will get the amount from the bill bill_id.total_amount
     amount = fields.Float(string='Amount', digits=(16, 2), tracking=True)
 
@@ -27,28 +28,37 @@ class PaymentRequest(models.Model):
     def _onchange_bill_id(self):
         """ Automatically fetch total amount when bill is selected """
         if self.bill_id:
+            self.update(self._prepare_bill_values(self.bill_id))
+
+    @api.model
+    def _prepare_bill_values(self, bill):
+        """ Amount, beneficiary and description of a payment request for the bill.
+            total_amount and summary_notes are stored on the bill, so this is cheap
+            to call for many bills in a row. """
+        values = {
             # Get amount from the related bill
-            self.amount = self.bill_id.total_amount
+            'amount': bill.total_amount,
+        }
         # Sync beneficiary if it's set on the bill
-            if self.bill_id.provider_id:
-                self.beneficiary = self.bill_id.provider_id
-            # Build description
-            base_text = 'Payment request for ISP services'
-            if self.bill_id.summary_notes:
-                self.description = base_text + '\n' + self.bill_id.summary_notes
-            else:
-                self.description = base_text
+        if bill.provider_id:
+            values['beneficiary'] = bill.provider_id.id
+        # Build description
+        base_text = 'Payment request for ISP services'
+        if bill.summary_notes:
+            values['description'] = base_text + '\n' + bill.summary_notes
+        else:
+            values['description'] = base_text
+        return values
 
-    
     @api.model_create_multi
     def create(self, vals_list):
         # 1. Standard Odoo Create
         records = super(PaymentRequest, self).create(vals_list)
         
-        # 2. After saving, update the linked bills to 'requested'
-        for record in records:
-            if record.bill_id:
-                record.bill_id.state = 'requested'
+        # 2. After saving, update the linked bills to 'requested' in one write
+        records.bill_id.write({'state': 'requested'})
+        # 3. Flag the unusual bill amounts before anyone approves the request
+        records.bill_id.action_detect_anomalies()
         return records
 
     def write(self, vals):
@@ -57,15 +67,12 @@ class PaymentRequest(models.Model):
         
         # 2. If the bill_id was changed during this save
         if 'bill_id' in vals:
-            for record in self:
-                if record.bill_id:
-                    record.bill_id.state = 'requested'
+            self.bill_id.write({'state': 'requested'})
+            self.bill_id.action_detect_anomalies()
         return res
     
     def unlink(self):
         """ This triggers when you delete the Payment Request """
-        for record in self:
-            if record.bill_id:
-                # Set the bill back to draft so it can be requested again later
-                record.bill_id.state = 'draft'
-        return super(PaymentRequest, self).unlink()
\ No newline at end of file
+        # Set the bills back to draft so they can be requested again later
+        self.bill_id.write({'state': 'draft'})
+        return super(PaymentRequest, self).unlink()
@@ -6,4 +6,5 @@ class ISPProvider(models.Model):
 
     name = fields.Char(string='Provider Name', required=True)
     notes = fields.Text(string='Notes')
-    service_ids = fields.One2many('isp.service', 'service_provider_id', string='Services Provided')
\ No newline at end of file
+    service_ids = fields.One2many('isp.service', 'service_provider_id', string='Services Provided')
+    layout_ids = fields.One2many('isp.invoice.layout', 'provider_id', string='Invoice Layouts')
\ No newline at end of file
@@ -1,4 +1,53 @@
+import re
+
 from odoo import models, fields, api
+from odoo.tools import SQL, split_every
+
+# Number of services updated per UPDATE statement by update_usage_bulk
+USAGE_BATCH_SIZE = 10000
+
+# Country calling codes dropped from line numbers, e.g. +966 55 123 4567 -> 551234567
+COUNTRY_PREFIXES = ('966',)
+
+
+def normalize_line_number(value):
+    """ Canonical lookup key of a line number: no spaces, dashes or punctuation,
+        and for phone numbers no international/country prefix nor leading zeros,
+        so "+966 55-123-4567", "00966551234567" and "0551234567" share one key. """
+    key = re.sub(r'[^0-9A-Za-z]', '', value or '').upper()
+    if not key.isdigit():
+        return key
+    # An all-zero number has no prefix to drop, it stays as typed
+    digits = key
+    if key.startswith('00'):
+        key = key[2:]
+    for prefix in COUNTRY_PREFIXES:
+        # Only a full international number carries the prefix (8+ digits after it)
+        if key.startswith(prefix) and len(key) >= len(prefix) + 8:
+            key = key[len(prefix):]
+            break
+    return key.lstrip('0') or digits
+
+
+def parse_usage(value):
+    """ Usage of a feed item as a non-negative integer, or None when it is not one
+        (12, "12" and 12.0 are accepted, "12.5", -1 and True are not) """
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return int(value) if value.isdigit() else None
+    if isinstance(value, (int, float)) and value >= 0 and value == int(value):
+        return int(value)
+    return None
+
+
+def normalize_account_number(value):
+    """ Canonical lookup key of a billing account number: no spaces, dashes or leading zeros """
+    key = re.sub(r'[^0-9A-Za-z]', '', value or '').upper()
+    return key.lstrip('0') or key
 
 
 class ISPService(models.Model):
@@ -12,6 +61,9 @@ class ISPService(models.Model):
     service_type_id = fields.Many2one('isp.service.type', required=True)
     line_number = fields.Char(required=True)
     billing_account_number = fields.Char(help='STC Billing Account Number')
+    # Normalized keys the importers and the usage feed match on
+    line_number_key = fields.Char(compute='_compute_lookup_keys', store=True, index=True)
+    billing_account_key = fields.Char(compute='_compute_lookup_keys', store=True, index=True)
     serial_number = fields.Char()
 
     status = fields.Selection([
@@ -39,6 +91,17 @@ class ISPService(models.Model):
     notes = fields.Text()
 
 
+    _line_number_key_uniq = models.Constraint(
+        'UNIQUE(service_provider_id, line_number_key)',
+        'This line number is already used by another service of this provider.',
+    )
+
+    @api.depends('line_number', 'billing_account_number')
+    def _compute_lookup_keys(self):
+        for rec in self:
+            rec.line_number_key = normalize_line_number(rec.line_number) or False
+            rec.billing_account_key = normalize_account_number(rec.billing_account_number) or False
+
     @api.depends('service_provider_id')
     def _compute_name(self):
         for rec in self:
@@ -47,4 +110,83 @@ class ISPService(models.Model):
     @api.depends('usage_limit', 'current_usage')
     def _compute_remaining(self):
         for rec in self:
-            rec.remaining_balance = (rec.usage_limit or 0) - (rec.current_usage or 0)
\ No newline at end of file
+            rec.remaining_balance = (rec.usage_limit or 0) - (rec.current_usage or 0)
+
+    # Fields of the service aggregated by isp.spend.report through its payment history
+    _SPEND_FIELDS = {'service_provider_id', 'service_type_id', 'assign_department_id', 'currency_id'}
+
+    def _spend_months(self):
+        """ First days of the months the services have payment history in """
+        return {
+            month for [month] in self.env['isp.payment.history'].sudo()._read_group(
+                [('service_id', 'in', self.ids), ('date_from', '!=', False)], ['date_from:month'])
+        }
+
+    def write(self, vals):
+        # The spend rollup joins the provider and service type of the service, and the
+        # history's department and currency are recomputed from it without calling its write()
+        if self._SPEND_FIELDS.intersection(vals):
+            self.env['isp.spend.report']._schedule_refresh(self._spend_months())
+        return super(ISPService, self).write(vals)
+
+    def unlink(self):
+        # The history goes with the service through ON DELETE CASCADE, not its unlink()
+        self.env['isp.spend.report']._schedule_refresh(self._spend_months())
+        return super(ISPService, self).unlink()
+
+    @api.model
+    def update_usage_bulk(self, usages, provider_id=None):
+        """ Set current_usage of many services at once, from the provider's usage feed.
+            :param usages: list of {'line_number': ..., 'current_usage': ...}
+            :param provider_id: only update the services of this provider
+            :return: {'updated': number of services updated, 'unknown': line numbers without service,
+                      'invalid': positions in usages of the items without a line number or a valid usage}
+
+            The services are updated with one UPDATE ... FROM (VALUES ...) statement per
+            USAGE_BATCH_SIZE services, remaining_balance being recomputed in the same
+            statement, instead of one ORM write per service. """
+        self.check_access('write')
+
+        usage_by_key = {}
+        numbers_by_key = {}
+        invalid = []
+        for position, usage in enumerate(usages):
+            # A bad item is reported back instead of failing the whole feed
+            if not isinstance(usage, dict):
+                invalid.append(position)
+                continue
+            line_number = str(usage.get('line_number') or '')
+            key = normalize_line_number(line_number)
+            current_usage = parse_usage(usage.get('current_usage'))
+            if not key or current_usage is None:
+                invalid.append(position)
+                continue
+            usage_by_key[key] = current_usage
+            numbers_by_key[key] = line_number
+
+        domain = [('line_number_key', 'in', list(usage_by_key))]
+        if provider_id:
+            domain.append(('service_provider_id', '=', int(provider_id)))
+        # search() applies the record rules, we only update what the user may see
+        services = self.search_fetch(domain, ['line_number_key'])
+
+        rows = [(service.id, usage_by_key[service.line_number_key]) for service in services]
+        self.flush_model(['usage_limit', 'current_usage', 'remaining_balance'])
+        for chunk in split_every(USAGE_BATCH_SIZE, rows):
+            self.env.cr.execute(SQL("""
+                UPDATE isp_service AS service
+                   SET current_usage = feed.usage,
+                       remaining_balance = COALESCE(service.usage_limit, 0) - feed.usage,
+                       write_uid = %s,
+                       write_date = (now() at time zone 'UTC')
+                  FROM (VALUES %s) AS feed(id, usage)
+                 WHERE service.id = feed.id
+            """, self.env.uid, SQL(", ").join(SQL("(%s, %s)", service_id, usage) for service_id, usage in chunk)))
+        self.invalidate_model(['current_usage', 'remaining_balance', 'write_uid', 'write_date'])
+
+        known_keys = set(services.mapped('line_number_key'))
+        return {
+            'updated': len(rows),
+            'unknown': [number for key, number in numbers_by_key.items() if key not in known_keys],
+            'invalid': invalid,
+        }
@@ -0,0 +1,81 @@
+from odoo import models, fields, api
+from odoo.tools import SQL
+
+
+class ISPSpendReport(models.Model):
+    """ Monthly spend per provider, department and service type.
+
+        The table is a rollup of isp.payment.history kept up to date by the history
+        itself: every create/write/unlink schedules the refresh of the months it
+        touched, and the refresh re-aggregates only those months before commit.
+        Pivot and graph views therefore read a few rows per month instead of
+        aggregating the whole history. """
+    _name = 'isp.spend.report'
+    _description = 'ISP Monthly Spend'
+    _auto = False
+    _order = 'month desc'
+
+    month = fields.Date(readonly=True)
+    provider_id = fields.Many2one('isp.provider', string="Provider", readonly=True)
+    department_id = fields.Many2one('hr.department', string="Department", readonly=True)
+    service_type_id = fields.Many2one('isp.service.type', string="Service Type", readonly=True)
+    currency_id = fields.Many2one('res.currency', string="Currency", readonly=True)
+    amount = fields.Monetary(readonly=True)
+    payment_count = fields.Integer(string="Payments", readonly=True)
+
+    def init(self):
+        self.env.cr.execute(SQL("""
+            CREATE TABLE IF NOT EXISTS isp_spend_report (
+                id SERIAL PRIMARY KEY,
+                month DATE NOT NULL,
+                provider_id INTEGER,
+                department_id INTEGER,
+                service_type_id INTEGER,
+                currency_id INTEGER,
+                amount NUMERIC NOT NULL DEFAULT 0,
+                payment_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS isp_spend_report_month_index ON isp_spend_report (month);
+        """))
+        self.env.cr.execute(SQL("SELECT 1 FROM isp_spend_report LIMIT 1"))
+        if not self.env.cr.rowcount:
+            self._refresh_rollup()
+
+    @api.model
+    def _schedule_refresh(self, months):
+        """ Refresh the rollup of these months (first days) once, right before commit """
+        months = {month for month in months if month}
+        if not months:
+            return
+        pending = self.env.cr.precommit.data.setdefault('isp.spend.report.months', set())
+        if not pending:
+            self.env.cr.precommit.add(self._refresh_pending)
+        pending.update(months)
+
+    def _refresh_pending(self):
+        months = self.env.cr.precommit.data.pop('isp.spend.report.months', set())
+        if months:
+            self._refresh_rollup(months)
+
+    @api.model
+    def _refresh_rollup(self, months=None):
+        """ Re-aggregate the given months from isp.payment.history, or everything when None """
+        self.env['isp.payment.history'].flush_model(['service_id', 'department_id', 'currency_id', 'amount', 'date_from'])
+        self.env['isp.service'].flush_model(['service_provider_id', 'service_type_id'])
+
+        if months is None:
+            month_filter = SQL("TRUE")
+        else:
+            month_filter = SQL("month IN %s", tuple(months))
+        self.env.cr.execute(SQL("DELETE FROM isp_spend_report WHERE %s", month_filter))
+        self.env.cr.execute(SQL("""
+            INSERT INTO isp_spend_report (month, provider_id, department_id, service_type_id, currency_id, amount, payment_count)
+                 SELECT month, service.service_provider_id, history.department_id, service.service_type_id,
+                        history.currency_id, SUM(history.amount), COUNT(*)
+                   FROM isp_payment_history AS history
+                   JOIN isp_service AS service ON service.id = history.service_id
+                  CROSS JOIN LATERAL (SELECT date_trunc('month', history.date_from)::date AS month) AS period
+                  WHERE history.date_from IS NOT NULL AND %s
+               GROUP BY month, service.service_provider_id, history.department_id, service.service_type_id, history.currency_id
+        """, month_filter))
+        self.invalidate_model()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+from openpyxl import Workbook
+
+from odoo import models, api
+from odoo.tools import SQL
+
+# Rows fetched per query while exporting, the export never holds more than this in memory
+EXPORT_CHUNK_SIZE = 5000
+
+
+class ISPXlsxExport(models.AbstractModel):
+    """ Streaming XLSX exports of bill lines and payment history.
+
+        Rows are read with keyset pagination (id > last id, LIMIT EXPORT_CHUNK_SIZE)
+        over the records the user may read, and appended to an openpyxl write-only
+        workbook that flushes them to disk, so memory stays flat whatever the row count.
+        The methods return the path of a temporary file, removed by the caller. """
+    _name = 'isp.xlsx.export'
+    _description = 'ISP XLSX Export'
+
+    BILL_LINE_HEADERS = [
+        'Bill', 'Line No.', 'Account No.', 'Service Type', 'Employee', 'Branch', 'Department',
+        'Usual Amount', 'Unusual', 'Amount Due',
+    ]
+    PAYMENT_HISTORY_HEADERS = [
+        'Line No.', 'Provider', 'Department', 'Billing Period', 'Period Start', 'Period End',
+        'Amount', 'Currency', 'Created On',
+    ]
+
+    @api.model
+    def _export_bill_lines(self, bill_ids):
+        self.env['isp.bill.line'].flush_model()
+        query = self.env['isp.bill.line']._search([('bill_id', 'in', bill_ids)])
+        rows = self._iter_chunks(query, SQL("""
+            SELECT line.id, bill.name, line.line_number, line.billing_account_number, service_type.name,
+                   employee.name, branch.name, department.name,
+                   line.baseline_amount, line.is_anomaly, line.amount
+              FROM isp_bill_line AS line
+              JOIN isp_bill AS bill ON bill.id = line.bill_id
+         LEFT JOIN isp_service_type AS service_type ON service_type.id = line.service_type_id
+         LEFT JOIN hr_employee AS employee ON employee.id = line.assign_employee_id
+         LEFT JOIN res_company AS branch ON branch.id = line.branch_id
+         LEFT JOIN hr_department AS department ON department.id = line.assign_department_id
+        """), 'line.id')
+        return self._write_workbook('Bill Lines', self.BILL_LINE_HEADERS, rows)
+
+    @api.model
+    def _export_payment_history(self, domain=None):
+        self.env['isp.payment.history'].flush_model()
+        query = self.env['isp.payment.history']._search(domain or [])
+        rows = self._iter_chunks(query, SQL("""
+            SELECT history.id, service.line_number, provider.name, department.name, history.period_name,
+                   history.date_from, history.date_to, history.amount, currency.name, history.created_date
+              FROM isp_payment_history AS history
+              JOIN isp_service AS service ON service.id = history.service_id
+         LEFT JOIN isp_provider AS provider ON provider.id = service.service_provider_id
+         LEFT JOIN hr_department AS department ON department.id = history.department_id
+         LEFT JOIN res_currency AS currency ON currency.id = history.currency_id
+        """), 'history.id')
+        return self._write_workbook('Payment History', self.PAYMENT_HISTORY_HEADERS, rows)
+
+    def _iter_chunks(self, query, select, id_column):
+        """ Yield the rows of select (without its id column) for the ids of query,
+            EXPORT_CHUNK_SIZE rows per statement, in id order. """
+        id_sql = SQL(id_column)
+        last_id = 0
+        while True:
+            self.env.cr.execute(SQL(
+                "%s WHERE %s IN %s AND %s > %s ORDER BY %s LIMIT %s",
+                select, id_sql, query.subselect(), id_sql, last_id, id_sql, EXPORT_CHUNK_SIZE,
+            ))
+            chunk = self.env.cr.fetchall()
+            if not chunk:
+                return
+            for row in chunk:
+                yield [self._cell(value) for value in row[1:]]
+            last_id = chunk[-1][0]
+
+    def _cell(self, value):
+        # Translatable names (res.company, hr.department...) are stored as jsonb
+        if isinstance(value, dict):
+            return value.get(self.env.lang) or value.get('en_US') or next(iter(value.values()), None)
+        return value
+
+    def _write_workbook(self, title, headers, rows):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(title)
+        sheet.append(headers)
+        for row in rows:
+            sheet.append(row)
+        handle, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        workbook.save(path)
+        return path
@@ -0,0 +1,9 @@
+from . import test_invoice_import
+from . import test_payment_requests
+from . import test_recurring_bills
+from . import test_spend_report
+from . import test_anomaly_detection
+from . import test_usage_feed
+from . import test_normalize
+from . import test_xlsx_export
+from . import test_import_benchmark
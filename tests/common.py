@@ -0,0 +1,141 @@
+import io
+import os
+import csv
+import base64
+import zipfile
+import tempfile
+from datetime import date
+
+import openpyxl
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from odoo.tests import TransactionCase
+
+# Services sharing a billing account in the generated data, like the STC account archives
+SERVICES_PER_ACCOUNT = 2
+
+# Text lines written per page of the generated PDF invoices
+PDF_LINES_PER_PAGE = 100
+
+
+class ISPImportCase(TransactionCase):
+    """ Synthetic providers, services and invoices, imported through isp.import.job.
+
+        The job commits after every batch of bill lines (and rolls back on failure),
+        which would end the test transaction: both are patched out so the whole
+        import runs in the test's savepoint. """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env = cls.env(context=dict(cls.env.context, tracking_disable=True, mail_create_nolog=True))
+        cls.service_type = cls.env.ref('ISP_Service_Management.isp_service_type_fiber')
+
+    def setUp(self):
+        super().setUp()
+        self.patch(type(self.env.cr), 'commit', lambda cr: None)
+        self.patch(type(self.env.cr), 'rollback', lambda cr: None)
+
+    def _create_provider(self, service_count, name='Test Provider'):
+        provider = self.env['isp.provider'].create({'name': name})
+        self.env['isp.service'].create([
+            {
+                'service_provider_id': provider.id,
+                'service_type_id': self.service_type.id,
+                'line_number': self._line_number(index),
+                'billing_account_number': self._account_number(index),
+                'monthly_fee': 100.0,
+            }
+            for index in range(service_count)
+        ])
+        return provider
+
+    def _line_number(self, index):
+        return '05%08d' % index
+
+    def _account_number(self, index):
+        return '1%09d' % (index // SERVICES_PER_ACCOUNT)
+
+    def _amount(self, index):
+        return 100 + index % 50 + 0.5
+
+    def _make_csv(self, service_count):
+        """ One row per service with the columns of the Generic CSV layout """
+        content = io.StringIO()
+        writer = csv.writer(content)
+        writer.writerow(['line_number', 'amount'])
+        for index in range(service_count):
+            writer.writerow([self._line_number(index), '%.2f' % self._amount(index)])
+        return content.getvalue().encode('utf-8')
+
+    def _make_zip(self, service_count):
+        """ One ACT_<account>.csv per billing account, the amount on row 14, column 1 """
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for index in range(0, service_count, SERVICES_PER_ACCOUNT):
+                content = io.StringIO()
+                csv.writer(content).writerows([['Account Summary', '']] * 13 + [['%.2f' % self._amount(index)]])
+                archive.writestr('ACT_%s.csv' % self._account_number(index), content.getvalue().encode('latin-1'))
+        return buffer.getvalue()
+
+    def _make_pdf(self, service_count):
+        """ STC-style invoice: each service number on its own line, and below it
+            the line "0.00 <amount> SAR" read by the default PDF layout """
+        lines = []
+        for index in range(service_count):
+            lines += [self._line_number(index), '0.00 %.2f SAR' % self._amount(index)]
+        return self._make_pdf_lines(lines)
+
+    def _make_pdf_lines(self, lines):
+        """ A PDF with these text lines, PDF_LINES_PER_PAGE lines per page """
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        _width, height = A4
+        for page_start in range(0, len(lines), PDF_LINES_PER_PAGE):
+            pdf.setFont('Helvetica', 6)
+            y = height - 30
+            for line in lines[page_start:page_start + PDF_LINES_PER_PAGE]:
+                pdf.drawString(40, y, line)
+                y -= 7.5
+            pdf.showPage()
+        pdf.save()
+        return buffer.getvalue()
+
+    def _make_xlsx(self, service_count):
+        """ One row per service with the columns of the Generic Excel layout """
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet('Invoice')
+        sheet.append(['line_number', 'amount'])
+        for index in range(service_count):
+            sheet.append([self._line_number(index), self._amount(index)])
+        handle, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        try:
+            workbook.save(path)
+            with open(path, 'rb') as xlsx_file:
+                return xlsx_file.read()
+        finally:
+            os.unlink(path)
+
+    def _import(self, provider, file_name, data):
+        """ Queue the file like the import wizard does and run the job at once """
+        job = self._create_job(provider, file_name, data)
+        job._process()
+        return job
+
+    def _create_job(self, provider, file_name, data):
+        template = self.env['isp.invoice.layout']._find_template(provider.id, file_name=file_name)
+        job = self.env['isp.import.job'].create({
+            'name': file_name,
+            'provider_id': provider.id,
+            'period_name': 'Test',
+            'date_from': date(2000, 1, 1),
+            'date_to': date(2000, 1, 31),
+            'total_days': 31,
+            'file_name': file_name,
+            'file_data': base64.b64encode(data),
+            'layout_id': template.id,
+        })
+        job._compute_content_hash()
+        return job
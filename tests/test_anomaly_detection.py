@@ -0,0 +1,46 @@
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import ISPImportCase
+
+
+@tagged('post_install', '-at_install')
+class TestAnomalyDetection(ISPImportCase):
+
+    def test_detect_anomalies(self):
+        provider = self._create_provider(3)
+        paid, fee_only, unknown = provider.service_ids.sorted('line_number')
+        unknown.monthly_fee = 0
+        self.env['isp.payment.history'].create([
+            {'service_id': paid.id, 'amount': amount, 'date_from': date(2000, month, 1), 'date_to': date(2000, month, 28)}
+            for month, amount in [(1, 100.0), (2, 110.0), (3, 90.0)]
+        ])
+        bill = self.env['isp.bill'].create({
+            'name': 'Anomaly Bill',
+            'provider_id': provider.id,
+            'date_from': date(2000, 4, 1),
+            'date_to': date(2000, 4, 30),
+            'line_ids': [
+                (0, 0, {'service_id': paid.id, 'amount': 200.0}),
+                (0, 0, {'service_id': fee_only.id, 'amount': 105.0}),
+                (0, 0, {'service_id': unknown.id, 'amount': 999.0}),
+            ],
+        })
+
+        bill.action_detect_anomalies()
+        lines = {line.service_id: line for line in bill.line_ids}
+
+        # Mean of the payments, the deviation raised to 10% of it: (200 - 100) / 10
+        self.assertEqual(lines[paid].baseline_amount, 100.0)
+        self.assertEqual(lines[paid].anomaly_score, 10.0)
+        self.assertTrue(lines[paid].is_anomaly)
+        # Without payments the monthly fee is the baseline
+        self.assertEqual(lines[fee_only].baseline_amount, 100.0)
+        self.assertEqual(lines[fee_only].anomaly_score, 0.5)
+        self.assertFalse(lines[fee_only].is_anomaly)
+        # Nothing to compare with, the line is never flagged
+        self.assertEqual(lines[unknown].baseline_amount, 0.0)
+        self.assertEqual(lines[unknown].anomaly_score, 0.0)
+        self.assertFalse(lines[unknown].is_anomaly)
+        self.assertEqual(bill.anomaly_count, 1)
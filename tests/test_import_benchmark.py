@@ -0,0 +1,69 @@
+import time
+import logging
+import tracemalloc
+from contextlib import contextmanager
+
+from odoo.tests import tagged
+
+from .common import ISPImportCase
+
+_logger = logging.getLogger(__name__)
+
+# Number of services (and invoice lines) of each benchmark run
+BENCHMARK_SIZES = (100, 1000)
+
+BENCHMARK_FILE_TYPES = ('pdf', 'zip', 'csv', 'xlsx')
+
+
+@tagged('post_install', '-at_install', '-standard', 'isp_benchmark')
+class TestImportBenchmark(ISPImportCase):
+    """ Import and posting benchmarks on synthetic data, not part of the standard run:
+
+            odoo-bin -d <db> --test-tags isp_benchmark
+
+        For every size and invoice format (STC-style PDF, ACT-named CSV archive, CSV,
+        XLSX), the invoice is imported through isp.import.job and the resulting bills
+        are posted. Wall time, SQL queries and Python peak memory of every step are
+        logged as "isp_benchmark ..." lines, followed by the phase timings of the
+        import jobs (see isp.import.log). Peak memory is traced with tracemalloc in
+        this process only: PDF pages extracted by worker processes are not included. """
+
+    @contextmanager
+    def _measure(self, name, row_count):
+        self.env.flush_all()
+        tracemalloc.start()
+        start, queries = time.perf_counter(), self.env.cr.sql_log_count
+        try:
+            yield
+            self.env.flush_all()
+        finally:
+            peak_memory = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+            tracemalloc.stop()
+        duration = time.perf_counter() - start
+        _logger.info(
+            "isp_benchmark name=%s rows=%s duration=%.3f queries=%s peak_memory_mb=%.1f",
+            name, row_count, duration, self.env.cr.sql_log_count - queries, peak_memory,
+        )
+
+    def test_benchmark(self):
+        for size in BENCHMARK_SIZES:
+            provider = self._create_provider(size, name='Benchmark %s' % size)
+            bills = self.env['isp.bill']
+            for file_type in BENCHMARK_FILE_TYPES:
+                data = getattr(self, '_make_%s' % file_type)(size)
+                with self._measure('import_%s' % file_type, size):
+                    job = self._import(provider, 'benchmark_%s.%s' % (size, file_type), data)
+                self.assertEqual(job.state, 'done', job.error_message)
+                self.assertEqual(job.line_count, size)
+                for log in job.log_ids:
+                    _logger.info(
+                        "isp_benchmark name=import_%s phase=%s rows=%s duration=%.3f queries=%s",
+                        file_type, log.phase, log.row_count, log.duration, log.query_count,
+                    )
+                bills |= job.bill_id
+
+            with self._measure('create_payment_requests', len(bills.line_ids)):
+                bills.action_create_payment_requests()
+            with self._measure('post_payment', len(bills.line_ids)):
+                bills.action_post_payment()
+            self.assertEqual(set(bills.mapped('state')), {'paid'})
@@ -0,0 +1,151 @@
+from odoo.tests import tagged
+from odoo.addons.ISP_Service_Management.models.isp_import_job import PDF_PAGE_POSITION_STRIDE
+
+from .common import ISPImportCase, SERVICES_PER_ACCOUNT
+
+# Queries the large import may run on top of the small one: the bill lines are inserted
+# in batches of BILL_LINE_BATCH_SIZE, so both sizes should fit in one batch each
+QUERY_COUNT_SLACK = 5
+
+
+@tagged('post_install', '-at_install')
+class TestInvoiceImport(ISPImportCase):
+
+    def test_import_csv(self):
+        provider = self._create_provider(25)
+        job = self._import(provider, 'invoice.csv', self._make_csv(25))
+
+        self.assertEqual(job.state, 'done', job.error_message)
+        self.assertEqual(job.line_count, 25)
+        self.assertEqual(len(job.bill_id.line_ids), 25)
+        self.assertAlmostEqual(
+            sum(job.bill_id.line_ids.mapped('amount')),
+            sum(self._amount(index) for index in range(25)),
+        )
+
+    def test_import_xlsx(self):
+        provider = self._create_provider(25)
+        job = self._import(provider, 'invoice.xlsx', self._make_xlsx(25))
+
+        self.assertEqual(job.state, 'done', job.error_message)
+        self.assertEqual(job.layout_id, self.env.ref('ISP_Service_Management.invoice_layout_generic_xlsx'))
+        self.assertEqual(job.line_count, 25)
+        self.assertAlmostEqual(
+            sum(job.bill_id.line_ids.mapped('amount')),
+            sum(self._amount(index) for index in range(25)),
+        )
+
+    def test_import_pdf(self):
+        provider = self._create_provider(3)
+        services = provider.service_ids.sorted('line_number')
+        # The amount is two lines below the number on this provider's invoices
+        self.env['isp.invoice.layout'].create({
+            'name': 'Offset PDF',
+            'provider_id': provider.id,
+            'file_type': 'pdf',
+            'file_name_pattern': r'\.pdf$',
+            'pdf_amount_line_offset': 2,
+        })
+        data = self._make_pdf_lines([
+            self._line_number(0), 'Monthly fee', '0.00 138.50 SAR',
+            self._line_number(1), 'Monthly fee', '0.00 20.00 SAR',
+            # A number repeated further down (e.g. a summary page) is only billed once
+            self._line_number(0), 'Monthly fee', '0.00 999.00 SAR',
+            '0599999999', 'Monthly fee', '0.00 5.00 SAR',
+        ])
+        job = self._import(provider, 'invoice.pdf', data)
+
+        self.assertEqual(job.state, 'done', job.error_message)
+        lines = job.bill_id.line_ids
+        self.assertEqual(lines.service_id, services[:2])
+        self.assertEqual(lines.filtered(lambda line: line.service_id == services[0]).amount, 138.5)
+        self.assertEqual(lines.filtered(lambda line: line.service_id == services[1]).amount, 20.0)
+
+        report = job.bill_id.message_ids.filtered(lambda message: 'Invoice numbers' in (message.body or ''))
+        self.assertEqual(len(report), 1)
+        self.assertIn('Services not found in the invoice (1): %s' % services[2].line_number, report.body)
+        self.assertIn('Invoice numbers without a matching service (1): 0599999999', report.body)
+
+    def test_import_zip(self):
+        # Every account of the archive bills both of its services
+        provider = self._create_provider(20)
+        job = self._import(provider, 'invoice.zip', self._make_zip(20))
+
+        self.assertEqual(job.state, 'done', job.error_message)
+        self.assertEqual(job.line_count, 20)
+        for line in job.bill_id.line_ids:
+            index = int(line.service_id.line_number[2:])
+            self.assertEqual(line.amount, self._amount(index - index % SERVICES_PER_ACCOUNT))
+
+    def test_duplicate(self):
+        provider = self._create_provider(10)
+        data = self._make_csv(10)
+        job = self._import(provider, 'invoice.csv', data)
+        self.assertEqual(self._create_job(provider, 'again.csv', data)._find_duplicate(), job.bill_id)
+
+    def test_failed_job_is_not_a_duplicate(self):
+        provider = self._create_provider(10)
+        job = self._import(provider, 'invoice.pdf', b'not a PDF')
+        self.assertEqual(job.state, 'failed')
+        self.assertFalse(job.bill_id.content_hash)
+        self.assertIsNone(self._create_job(provider, 'again.pdf', b'not a PDF')._find_duplicate())
+
+    def _resume(self, provider, file_name, data, billed_count, checkpoint):
+        """ Run a job as if a previous run committed the lines of the first
+            billed_count services (with an amount of 1.0) up to checkpoint """
+        services = provider.service_ids.sorted('line_number')
+        job = self._create_job(provider, file_name, data)
+        bill = job._get_or_create_bill()
+        self.env['isp.bill.line'].create([
+            {'bill_id': bill.id, 'service_id': service.id, 'amount': 1.0}
+            for service in services[:billed_count]
+        ])
+        job.write({'state': 'running', 'checkpoint': checkpoint, 'line_count': billed_count})
+        job._process()
+
+        self.assertEqual(job.state, 'done', job.error_message)
+        self.assertEqual(job.line_count, len(services))
+        self.assertEqual(len(bill.line_ids), len(services))
+        self.assertEqual(bill.line_ids.service_id, services)
+        # The lines before the checkpoint are kept, not read again
+        billed = bill.line_ids.filtered(lambda line: line.service_id in services[:billed_count])
+        self.assertEqual(set(billed.mapped('amount')), {1.0})
+        return job
+
+    def test_resume_zip(self):
+        # 5 accounts of 2 services committed
+        provider = self._create_provider(20)
+        self._resume(provider, 'invoice.zip', self._make_zip(20), 10, 5)
+
+    def test_resume_pdf(self):
+        # Two pages of 50 services, the first page and the first number of the second committed
+        provider = self._create_provider(60)
+        job = self._resume(provider, 'invoice.pdf', self._make_pdf(60), 51, 1 * PDF_PAGE_POSITION_STRIDE + 1)
+        # The services billed on the first page are not reported as missing from the invoice
+        self.assertFalse(job.bill_id.message_ids.filtered(lambda message: 'not found' in (message.body or '')))
+
+    def test_import_csv_progress(self):
+        provider = self._create_provider(25)
+        job = self._import(provider, 'invoice.csv', self._make_csv(30))
+        self.assertEqual(job.total_count, 30)
+        self.assertEqual(job.line_count, 25)
+
+    def test_import_query_count_is_flat(self):
+        small = self._create_provider(10, name='Small Provider')
+        large = self._create_provider(1000, name='Large Provider')
+        small_data, large_data = self._make_csv(10), self._make_csv(1000)
+        # Compile the layouts of both providers before counting
+        for provider in (small, large):
+            self.env['isp.invoice.layout']._find_template(provider.id, file_name='invoice.csv')
+
+        self.env.flush_all()
+        queries = self.env.cr.sql_log_count
+        small_job = self._import(small, 'small.csv', small_data)
+        self.env.flush_all()
+        small_queries = self.env.cr.sql_log_count - queries
+        self.assertEqual(small_job.line_count, 10)
+
+        with self.assertQueryCount(small_queries + QUERY_COUNT_SLACK):
+            large_job = self._import(large, 'large.csv', large_data)
+        self.assertEqual(large_job.state, 'done', large_job.error_message)
+        self.assertEqual(large_job.line_count, 1000)
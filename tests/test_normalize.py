@@ -0,0 +1,31 @@
+from odoo.tests import tagged
+from odoo.tests.common import BaseCase
+
+from odoo.addons.ISP_Service_Management.models.isp_service import normalize_line_number, normalize_account_number
+
+
+@tagged('post_install', '-at_install')
+class TestNormalize(BaseCase):
+
+    def test_normalize_line_number(self):
+        for value in ('+966 55-123-4567', '00966551234567', '0551234567', '551234567', '(055) 123 4567'):
+            self.assertEqual(normalize_line_number(value), '551234567', value)
+        # All zeros, with or without the 00 international prefix
+        self.assertEqual(normalize_line_number('0'), '0')
+        self.assertEqual(normalize_line_number('0000'), '0000')
+        self.assertEqual(normalize_line_number('00 00'), '0000')
+        # Short numbers only lose their leading zeros, 966 is not a prefix on them
+        self.assertEqual(normalize_line_number('0123'), '123')
+        self.assertEqual(normalize_line_number('966123'), '966123')
+        self.assertEqual(normalize_line_number('00966123'), '966123')
+        # Circuit ids are not phone numbers, only their punctuation goes
+        self.assertEqual(normalize_line_number('dsl-0012 ab'), 'DSL0012AB')
+        self.assertEqual(normalize_line_number(''), '')
+        self.assertEqual(normalize_line_number(None), '')
+
+    def test_normalize_account_number(self):
+        self.assertEqual(normalize_account_number('100 000-123'), '100000123')
+        self.assertEqual(normalize_account_number('000123'), '123')
+        self.assertEqual(normalize_account_number('0000'), '0000')
+        self.assertEqual(normalize_account_number('acc-001'), 'ACC001')
+        self.assertEqual(normalize_account_number(False), '')
@@ -0,0 +1,68 @@
+import time
+import logging
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import ISPImportCase
+
+_logger = logging.getLogger(__name__)
+
+LINES_PER_BILL = 5
+
+
+@tagged('post_install', '-at_install')
+class TestPaymentRequests(ISPImportCase):
+
+    def _create_bills(self, provider, count):
+        services = provider.service_ids
+        bills = self.env['isp.bill'].create([
+            {
+                'name': '%s %s' % (provider.name, index),
+                'provider_id': provider.id,
+                'date_from': date(2000, 1, 1),
+                'date_to': date(2000, 1, 31),
+                'line_ids': [
+                    (0, 0, {'service_id': service.id, 'amount': self._amount(service_index)})
+                    for service_index, service in enumerate(services[:LINES_PER_BILL])
+                ],
+            }
+            for index in range(count)
+        ])
+        self.env.flush_all()
+        return bills
+
+    def _measure_payment_requests(self, bills):
+        """ Return (queries, seconds) of requesting payment for the bills """
+        self.env.invalidate_all()
+        queries, start = self.env.cr.sql_log_count, time.perf_counter()
+        bills.action_create_payment_requests()
+        self.env.flush_all()
+        return self.env.cr.sql_log_count - queries, time.perf_counter() - start
+
+    def test_create_payment_requests(self):
+        provider = self._create_provider(LINES_PER_BILL)
+        bills = self._create_bills(provider, 3)
+        bills.action_create_payment_requests()
+
+        requests = self.env['isp.payment.request'].search([('bill_id', 'in', bills.ids)])
+        self.assertEqual(len(requests), 3)
+        self.assertEqual(set(bills.mapped('state')), {'requested'})
+        for request in requests:
+            self.assertAlmostEqual(request.amount, request.bill_id.total_amount)
+            self.assertEqual(request.beneficiary, provider)
+
+    def test_create_payment_requests_scaling(self):
+        """ Requesting payment for 10x more bills must not cost more queries per bill """
+        provider = self._create_provider(LINES_PER_BILL)
+        small = self._create_bills(provider, 20)
+        large = self._create_bills(provider, 200)
+
+        small_queries, small_time = self._measure_payment_requests(small)
+        large_queries, large_time = self._measure_payment_requests(large)
+        _logger.info(
+            "isp.payment.request: %s bills %s queries %.2f ms/bill, %s bills %s queries %.2f ms/bill",
+            len(small), small_queries, 1000 * small_time / len(small),
+            len(large), large_queries, 1000 * large_time / len(large),
+        )
+        self.assertLessEqual(large_queries / len(large), small_queries / len(small))
@@ -0,0 +1,55 @@
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import ISPImportCase
+
+
+@tagged('post_install', '-at_install')
+class TestRecurringBills(ISPImportCase):
+
+    def _create_service(self, provider, line_number, recurring_day):
+        return self.env['isp.service'].create({
+            'service_provider_id': provider.id,
+            'service_type_id': self.service_type.id,
+            'line_number': line_number,
+            'status': 'active',
+            'monthly_fee': 100.0,
+            'recurring_day': recurring_day,
+        })
+
+    def _generate(self, provider, billing_date):
+        """ The recurring bills of the provider touched by a run on billing_date """
+        bills = self.env['isp.bill']._generate_recurring_bills(date(2001, 2, 1), date(2001, 2, 28), billing_date)
+        return bills.filtered(lambda bill: bill.provider_id == provider)
+
+    def test_recurring_day(self):
+        provider = self.env['isp.provider'].create({'name': 'Recurring Provider'})
+        early = self._create_service(provider, '0500000001', 5)
+        late = self._create_service(provider, '0500000002', 20)
+        month_end = self._create_service(provider, '0500000003', 31)
+
+        bill = self._generate(provider, date(2001, 2, 10))
+        self.assertEqual(bill.line_ids.service_id, early)
+
+        # A service added after the first run is billed on the next one, on the same bill
+        added = self._create_service(provider, '0500000004', 3)
+        self.assertEqual(self._generate(provider, date(2001, 2, 20)), bill)
+        self.assertEqual(bill.line_ids.service_id, early | late | added)
+
+        # recurring_day 31 is billed on the last day of February, and nothing twice
+        self.assertEqual(self._generate(provider, date(2001, 2, 28)), bill)
+        self.assertEqual(bill.line_ids.service_id, early | late | added | month_end)
+        self.assertFalse(self._generate(provider, date(2001, 2, 28)))
+        self.assertEqual(len(bill.line_ids), 4)
+
+    def test_new_bill_when_not_draft(self):
+        provider = self.env['isp.provider'].create({'name': 'Recurring Provider'})
+        self._create_service(provider, '0500000001', 1)
+        bill = self._generate(provider, date(2001, 2, 1))
+        bill.action_confirm()
+
+        service = self._create_service(provider, '0500000002', 1)
+        new_bill = self._generate(provider, date(2001, 2, 2))
+        self.assertNotEqual(new_bill, bill)
+        self.assertEqual(new_bill.line_ids.service_id, service)
@@ -0,0 +1,45 @@
+from datetime import date
+
+from odoo.tests import tagged
+
+from .common import ISPImportCase
+
+
+@tagged('post_install', '-at_install')
+class TestSpendReport(ISPImportCase):
+
+    def _spend(self, **domain):
+        self.env.cr.precommit.run()
+        rows = self.env['isp.spend.report'].search([
+            ('month', '=', date(2001, 3, 1)),
+            *((field_name, '=', value.id) for field_name, value in domain.items()),
+        ])
+        return sum(rows.mapped('amount'))
+
+    def test_refresh_on_service_changes(self):
+        provider = self._create_provider(1)
+        service = provider.service_ids
+        self.env['isp.payment.history'].create({
+            'service_id': service.id,
+            'amount': 250.0,
+            'date_from': date(2001, 3, 1),
+            'date_to': date(2001, 3, 31),
+        })
+        self.assertEqual(self._spend(service_type_id=self.service_type), 250.0)
+
+        other_type = self.env['isp.service.type'].create({'name': 'Other Type'})
+        service.service_type_id = other_type
+        self.assertEqual(self._spend(service_type_id=self.service_type), 0.0)
+        self.assertEqual(self._spend(service_type_id=other_type), 250.0)
+
+        department = self.env['hr.department'].create({'name': 'Spend Department'})
+        service.assign_department_id = department
+        self.assertEqual(self._spend(department_id=department), 250.0)
+
+        currency = self.env['res.currency'].with_context(active_test=False).search(
+            [('id', '!=', service.currency_id.id)], limit=1)
+        service.currency_id = currency
+        self.assertEqual(self._spend(currency_id=currency), 250.0)
+
+        service.unlink()
+        self.assertEqual(self._spend(provider_id=provider), 0.0)
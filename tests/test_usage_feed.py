@@ -0,0 +1,30 @@
+from odoo.tests import tagged
+
+from .common import ISPImportCase
+
+
+@tagged('post_install', '-at_install')
+class TestUsageFeed(ISPImportCase):
+
+    def test_update_usage_bulk(self):
+        provider = self._create_provider(3)
+        other_provider = self._create_provider(1, name='Other Provider')
+        services = provider.service_ids.sorted('line_number')
+        services.usage_limit = 500
+
+        result = self.env['isp.service'].update_usage_bulk([
+            {'line_number': '+966 5%s' % services[0].line_number[2:], 'current_usage': 120},
+            {'line_number': services[1].line_number, 'current_usage': '80'},
+            {'line_number': services[2].line_number, 'current_usage': '12.5'},
+            {'line_number': other_provider.service_ids.line_number, 'current_usage': 10},
+            {'line_number': '0599999999', 'current_usage': 10},
+            {'current_usage': 10},
+            'not an item',
+        ], provider_id=provider.id)
+
+        self.assertEqual(result['updated'], 2)
+        self.assertEqual(result['unknown'], [other_provider.service_ids.line_number, '0599999999'])
+        self.assertEqual(result['invalid'], [2, 5, 6])
+        self.assertEqual(services.mapped('current_usage'), [120, 80, 0])
+        self.assertEqual(services.mapped('remaining_balance'), [380, 420, 500])
+        self.assertEqual(other_provider.service_ids.current_usage, 0)
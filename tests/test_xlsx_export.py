@@ -0,0 +1,86 @@
+import os
+from datetime import date
+
+import openpyxl
+
+from odoo.tests import tagged
+from odoo.addons.ISP_Service_Management.models import isp_xlsx_export
+
+from .common import ISPImportCase
+
+
+@tagged('post_install', '-at_install')
+class TestXlsxExport(ISPImportCase):
+
+    def setUp(self):
+        super().setUp()
+        # Several chunks even for a few rows
+        self.patch(isp_xlsx_export, 'EXPORT_CHUNK_SIZE', 2)
+
+    def _read(self, path):
+        """ The rows of the exported workbook, the file removed """
+        self.addCleanup(os.unlink, path)
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            return list(workbook.active.values)
+        finally:
+            workbook.close()
+
+    def test_export_bill_lines(self):
+        provider = self._create_provider(5)
+        services = provider.service_ids.sorted('line_number')
+        department = self.env['hr.department'].create({'name': 'Export Department'})
+        services[0].assign_department_id = department
+        bill, other_bill = self.env['isp.bill'].create([
+            {
+                'name': name,
+                'provider_id': provider.id,
+                'date_from': date(2000, 1, 1),
+                'date_to': date(2000, 1, 31),
+                'line_ids': [
+                    (0, 0, {'service_id': service.id, 'amount': self._amount(index)})
+                    for index, service in enumerate(services)
+                ],
+            }
+            for name in ('Export Bill', 'Other Bill')
+        ])
+
+        export = self.env['isp.xlsx.export']
+        rows = self._read(export._export_bill_lines(bill.ids))
+
+        self.assertEqual(list(rows[0]), export.BILL_LINE_HEADERS)
+        self.assertEqual(len(rows), 6)
+        lines = [dict(zip(export.BILL_LINE_HEADERS, row)) for row in rows[1:]]
+        self.assertEqual({line['Bill'] for line in lines}, {'Export Bill'})
+        self.assertEqual([line['Line No.'] for line in lines], services.mapped('line_number'))
+        self.assertEqual([line['Amount Due'] for line in lines], [self._amount(index) for index in range(5)])
+        self.assertEqual(lines[0]['Service Type'], self.service_type.name)
+        self.assertEqual(lines[0]['Department'], 'Export Department')
+        self.assertIsNone(lines[1]['Department'])
+
+    def test_export_payment_history(self):
+        provider = self._create_provider(3)
+        self.env['isp.payment.history'].create([
+            {
+                'service_id': service.id,
+                'period_name': 'Month %s' % month,
+                'amount': 100.0 * month,
+                'date_from': date(2000, month, 1),
+                'date_to': date(2000, month, 28),
+            }
+            for service in provider.service_ids
+            for month in (1, 2)
+        ])
+
+        export = self.env['isp.xlsx.export']
+        rows = self._read(export._export_payment_history([
+            ('service_id.service_provider_id', '=', provider.id),
+            ('date_from', '>=', date(2000, 2, 1)),
+        ]))
+
+        self.assertEqual(list(rows[0]), export.PAYMENT_HISTORY_HEADERS)
+        history = [dict(zip(export.PAYMENT_HISTORY_HEADERS, row)) for row in rows[1:]]
+        self.assertEqual(sorted(line['Line No.'] for line in history), sorted(provider.service_ids.mapped('line_number')))
+        self.assertEqual({line['Billing Period'] for line in history}, {'Month 2'})
+        self.assertEqual({line['Amount'] for line in history}, {200.0})
+        self.assertEqual({line['Provider'] for line in history}, {provider.name})